@@ -1,23 +1,71 @@
 import os
-import requests
 import json
-from dotenv import load_dotenv
+import time
+import asyncio
+import hashlib
+import logging
+from functools import lru_cache
+from html import escape
+import anthropic_client
+import completion_parser
+import context_builder
+import metrics
+import prompt_cache
 import sec_parser as sp
-from sec_parser.processing_steps import TopSectionManagerFor10Q, IndividualSemanticElementExtractor, TopSectionTitleCheck
+import text_cache
+from lxml import etree
+from sec_parser.processing_steps import TopSectionManagerFor10Q, TopSectionTitleCheck
 
-def analyze(filing_text, api_url="https://api.anthropic.com/v1/complete"):
+logger = logging.getLogger(__name__)
+
+MODEL = os.environ.get('ANTHROPIC_MODEL', "claude-v1")
+# Bump whenever the prompt changes so that saved analyses are refreshed
+PROMPT_VERSION = 2
+# The prompt version and model of the analyses saved before analysis.meta.json was written
+LEGACY_PROMPT_VERSION = 1
+LEGACY_MODEL = "claude-v1"
+# Filings larger than this are parsed in streaming mode, in batches of top-level elements
+STREAMING_THRESHOLD_BYTES = int(os.environ.get('PARSE_STREAMING_THRESHOLD_BYTES', 8 * 1024 * 1024))
+STREAMING_BATCH_CHARS = int(os.environ.get('PARSE_STREAMING_BATCH_CHARS', 2 * 1024 * 1024))
+
+def hash_filing(filing_html_path):
     """
-    Analyze the given filing text using the Anthropic API.
+    Compute the content hash of a filing document.
 
     Args:
-        - filing_text (str): The semantically parsed text of the filing to analyze.
-        - api_url (str): The URL of the Anthropic API.
+        - filing_html_path (str): The path to the filing document.
 
     Returns:
-        - dict: The analysis results in JSON format.
+        - str: The SHA-256 hex digest of the document.
     """
+    digest = hashlib.sha256()
+    with open(filing_html_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    prompt = """From the "Management's Discussion and Analysis of Financial Condition and Results of Operations" and "Financial Statements and Supplementary Data" sections, extract the following information: Revenue (product wise if applicable), Net Income (product wise if applicable), Effective Tax Rate, Deferred Tax Assets, Deferred Tax Liabilities, Foreign Income Percentage, and any other relevant financial information
+def analysis_cache_key(filing_html_path):
+    """
+    Build the key that a saved analysis of the given filing must match to be reused.
+
+    Args:
+        - filing_html_path (str): The path to the filing document.
+
+    Returns:
+        - dict: The filing content hash, prompt version and model of the analysis.
+    """
+    return {
+        "filing_sha256": hash_filing(filing_html_path),
+        "prompt_version": PROMPT_VERSION,
+        "model": MODEL
+    }
+
+# The fields every analysis must contain
+MAIN_FIELDS = list(completion_parser.ANALYSIS_SCHEMA)
+# How many more times the model is asked for the main fields missing from its answer
+FIELD_RETRIES = int(os.environ.get('ANALYZE_FIELD_RETRIES', 1))
+
+PROMPT = """From the "Management's Discussion and Analysis of Financial Condition and Results of Operations" and "Financial Statements and Supplementary Data" sections, extract the following information: Revenue (product wise if applicable), Net Income (product wise if applicable), Effective Tax Rate, Deferred Tax Assets, Deferred Tax Liabilities, Foreign Income Percentage, and any other relevant financial information
 
     answer in proper json format. Make sure the format is right that is it doesn't face the JSONDecodeError: Expecting ',' delimiter issue. Note: Only return the json, no additional text.
     Example Json (sub-fields may not match completely and change but the units should be same (billions), convert if you need to)
@@ -34,74 +82,403 @@ def analyze(filing_text, api_url="https://api.anthropic.com/v1/complete"):
     Note: main fields ("Revenue", "Net Income", "Effective Tax Rate", "Deferred Tax Assets", "Deferred Tax Liabilities", "Foreign Income Percentage") should be present in the json. However, sub-fields may vary for example for Revenue the source of revenue may be different for different companies or different for same company in different years. You should mention the source of revenue in the sub-fields.
     Also mention profit or loss with positive or negative sign in front of the number.
     Make sure the json format is parseable and correct and doesn't face issues like "Expecting property name enclosed in double quotes", "Expecting ',' delimiter", etc.
+"""
+
+def field_prompt(fields):
+    """
+    Build the prompt asking for some of the main fields only.
+
+    Args:
+        - fields (list): The main fields to extract, or None for all of them.
+
+    Returns:
+        - str: The prompt.
     """
+    if not fields or set(fields) >= set(MAIN_FIELDS):
+        return PROMPT
+    return PROMPT + f"""    Only the following main fields are needed this time, leave the other main fields out: {', '.join(f'"{field}"' for field in fields)}.
+"""
 
-    max_tokens = 102398
-    token_limit = max_tokens - len(prompt) - 100
-    truncated_filing_text = filing_text[:token_limit]
+def build_payload(filing_text, fields=None):
+    """
+    Build the completion request for the given filing text.
 
-    input_text = truncated_filing_text + "\n\n" + prompt
+    Args:
+        - filing_text (str): The semantically parsed text of the filing to analyze.
+        - fields (list): The main fields to ask for, or None for all of them.
 
-    # Load environment variables from .env file
-    dotenv_path = os.path.join(os.getcwd(), '.env')
-    load_dotenv(dotenv_path)
-    api_key = os.environ.get('ANTHROPIC_API_KEY')
-    
-    if not api_key:
-        print("Error: ANTHROPIC_API_KEY environment variable not set.")
-        return None
+    Returns:
+        - dict: The request body for the Anthropic API.
+    """
+    truncated_filing_text = context_builder.truncate_to_tokens(filing_text, context_builder.CONTEXT_TOKENS)
 
-    headers = {
-        "Content-Type": "application/json",
-        "X-API-Key": api_key,
-        "anthropic-version": "2023-06-01"
-    }
+    input_text = truncated_filing_text + "\n\n" + field_prompt(fields)
 
-    payload = {
+    return {
         "prompt": f"\n\nHuman: {input_text}\n\nAssistant:",
         "stop_sequences": ["\n\nHuman"],
-        "model": "claude-v1",
+        "model": MODEL,
         "max_tokens_to_sample": 1000
     }
 
-    response = requests.post(api_url, headers=headers, data=json.dumps(payload))
+def parse_completion(completion):
+    """
+    Parse the JSON analysis out of a completion, repairing it if needed.
+
+    Args:
+        - completion (str): The completion text.
+
+    Returns:
+        - dict: The analysis results, or None if no JSON object could be recovered.
+    """
+    analysis = completion_parser.parse_json(completion)
+    if analysis is None:
+        print("Error: no JSON object could be recovered from the completion")
+    return analysis
 
-    if response.status_code == 200:
-        insights = response.json()["completion"]
-        print(insights)
+def save_completion(completions_path, fields, completion):
+    """
+    Append a raw completion to a JSON lines log.
+
+    Args:
+        - completions_path (str): The path of the log, or None to keep nothing.
+        - fields (list): The main fields the completion was asked for.
+        - completion (str): The completion text.
+
+    Returns:
+        - None
+    """
+    if completions_path is None:
+        return
+    os.makedirs(os.path.dirname(completions_path) or '.', exist_ok=True)
+    with open(completions_path, 'a') as f:
+        f.write(json.dumps({"time": time.time(), "fields": fields, "completion": completion}) + "\n")
+
+def analyze(filing_text, api_url=anthropic_client.API_URL, fields=None, completions_path=None, use_cache=True):
+    """
+    Analyze the given filing text using the Anthropic API.
+
+    Complete results are cached by the prompt version, the model, the requested fields and the
+    hash of the text, so an identical context never costs a second call, whichever filing it
+    came from. Partial results are not cached, so their missing fields are asked for again.
+    The request goes through the client shared by the whole process, so concurrent callers
+    reuse its connections, concurrency limit, retries and token budget. The completion is
+    repaired and checked against the schema of the main fields, and the model is asked again,
+    up to FIELD_RETRIES times, for the main fields that are missing or invalid only.
+
+    Args:
+        - filing_text (str): The semantically parsed text of the filing to analyze.
+        - api_url (str): The URL of the Anthropic API.
+        - fields (list): The main fields to ask for, or None for all of them.
+        - completions_path (str): A JSON lines file every raw completion is appended to, or None.
+        - use_cache (bool): Whether to reuse and store the result in the prompt result cache.
+
+    Returns:
+        - dict: The analysis results in JSON format, which may lack some main fields; None if no
+          field could be recovered.
+    """
+    missing_fields = list(fields or MAIN_FIELDS)
+    if use_cache:
+        result_key = prompt_cache.cache_key(PROMPT_VERSION, MODEL, filing_text, missing_fields)
+        cached = prompt_cache.load_result(result_key)
+        if cached is not None:
+            return cached
+
+    if not anthropic_client.load_api_key():
+        print("Error: ANTHROPIC_API_KEY environment variable not set.")
+        return None
+
+    client = anthropic_client.get_client(api_url)
+    analysis = {}
+    for attempt in range(FIELD_RETRIES + 1):
         try:
-            return json.loads(insights)
-        except json.JSONDecodeError as e:
+            with metrics.span('llm_call'):
+                insights = anthropic_client.run_sync(client.complete(build_payload(filing_text, missing_fields)))
+        except anthropic_client.APIError as e:
             print(f"Error: {e}")
-            return None
-    else:
-        print(f"Error: {response.status_code} - {response.text}")
-        return None
-  
+            break
+        save_completion(completions_path, missing_fields, insights)
+        logger.debug("Completion: %s", insights)
+
+        with metrics.span('json_decode'):
+            parsed = parse_completion(insights)
+            if parsed is None:
+                if attempt < FIELD_RETRIES:
+                    metrics.inc('llm_retries_total', reason='invalid_json')
+                continue
+            valid, still_missing = completion_parser.validate_analysis(parsed, missing_fields)
+        for key, value in valid.items():
+            if key in missing_fields or key not in analysis:
+                analysis[key] = value
+        missing_fields = still_missing
+        if not missing_fields:
+            break
+        if attempt < FIELD_RETRIES:
+            print(f"Missing fields {missing_fields}, asking again...")
+            metrics.inc('llm_retries_total', reason='missing_fields')
+
+    # A partial result, e.g. one cut short by an API error, would keep its missing fields missing for good
+    if use_cache and analysis and not missing_fields:
+        prompt_cache.save_result(result_key, analysis, PROMPT_VERSION, MODEL)
+    return analysis or None
+
+async def analyze_many(filings, api_url=anthropic_client.API_URL, max_concurrency=anthropic_client.MAX_CONCURRENCY,
+                       tokens_per_minute=anthropic_client.TOKENS_PER_MINUTE):
+    """
+    Analyze many filings concurrently and stream the results back as they complete.
+
+    Args:
+        - filings: An iterable of (key, filing_text) tuples, the key identifying the filing to the caller.
+        - api_url (str): The URL of the Anthropic API.
+        - max_concurrency (int): The maximum number of requests in flight.
+        - tokens_per_minute (int): The token budget of the requests.
+
+    Yields:
+        - tuple: (key, analysis) for each filing in completion order, the analysis being None on failure.
+    """
+    if not anthropic_client.load_api_key():
+        print("Error: ANTHROPIC_API_KEY environment variable not set.")
+        for key, _ in filings:
+            yield key, None
+        return
+
+    async with anthropic_client.AnthropicClient(api_url=api_url, max_concurrency=max_concurrency,
+                                                tokens_per_minute=tokens_per_minute) as client:
+        async def analyze_one(key, filing_text):
+            try:
+                with metrics.span('llm_call'):
+                    completion = await client.complete(build_payload(filing_text))
+            except anthropic_client.APIError as e:
+                print(f"Error: {e}")
+                return key, None
+            with metrics.span('json_decode'):
+                return key, parse_completion(completion)
+
+        tasks = [asyncio.ensure_future(analyze_one(key, filing_text)) for key, filing_text in filings]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+class Edgar10KParser(sp.Edgar10QParser):
+    """
+    Edgar10QParser without the 10-Q specific top section handling, for 10-K filings.
+
+    The single element checks are stateless and built once. The processing steps keep state
+    while they process a document, so sec-parser only lets each of them process one document;
+    they are created on every parse. The parser itself holds no per-document state and can be
+    shared by all the threads of a process.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._checks = tuple(check for check in super().get_default_single_element_checks()
+                             if not isinstance(check, TopSectionTitleCheck))
+
+    def get_default_single_element_checks(self):
+        return list(self._checks)
+
+    def get_default_steps(self, get_checks=None):
+        return [step for step in super().get_default_steps(get_checks) if not isinstance(step, TopSectionManagerFor10Q)]
+
+@lru_cache(maxsize=None)
+def get_10k_parser():
+    """
+    Get the 10-K parser of this process, building it on first use.
+
+    Returns:
+        - Edgar10KParser: The parser shared by every parse in the process.
+    """
+    return Edgar10KParser()
+
 def without_10q_related_steps():
-    all_steps = sp.Edgar10QParser().get_default_steps()
-    
-    # Change 1: Remove the TopSectionManagerFor10Q
-    steps_without_top_section_manager = [step for step in all_steps if not isinstance(step, TopSectionManagerFor10Q)]
-    
-    # Change 2: Replace the IndividualSemanticElementExtractor with a new one that has the top section checks removed
-    def get_checks_without_top_section_title_check():
-        all_checks = sp.Edgar10QParser().get_default_single_element_checks()
-        return [check for check in all_checks if not isinstance(check, TopSectionTitleCheck)]
-    return [
-        IndividualSemanticElementExtractor(get_checks=get_checks_without_top_section_title_check) 
-        if isinstance(step, IndividualSemanticElementExtractor) 
-        else step
-        for step in steps_without_top_section_manager
-    ]
-
-def parse_filing_text(filing_html_path):
+    return get_10k_parser().get_default_steps()
+
+def group_sections(texts):
+    """
+    Group the texts of the elements of a filing into sections, one per heading.
+
+    Args:
+        - texts: An iterable of (text, is_title) tuples in document order.
+
+    Yields:
+        - dict: Each section as soon as the next heading starts, with the "title" of its heading,
+          the 10-K "item" it belongs to (e.g. "7" or "8", None before the first item) and its
+          "text", which starts with the heading itself.
+    """
+    title, item, section_texts = "", None, []
+    for text, is_title in texts:
+        if not text:
+            continue
+        if is_title:
+            if section_texts:
+                yield {"title": title, "item": item, "text": ' '.join(section_texts)}
+            title, item, section_texts = text, context_builder.item_number(text) or item, []
+        section_texts.append(text)
+    if section_texts:
+        yield {"title": title, "item": item, "text": ' '.join(section_texts)}
+
+def _is_title(element):
+    return isinstance(element, (sp.TitleElement, sp.TopSectionTitle))
+
+def iter_top_level_html(filing_html_path, read_chars=1024 * 1024):
+    """
+    Stream the top-level elements of the body of a filing document as HTML strings.
+
+    The document is read and parsed incrementally, and every element is dropped from the parse
+    tree once it has been serialized, so memory stays bounded by the largest top-level element.
+
+    Args:
+        - filing_html_path (str): The path to the filing document.
+        - read_chars (int): The number of characters read from the file at a time.
+
+    Yields:
+        - str: The HTML of each top-level element, and the text between them when it is not blank.
+    """
+    parser = etree.HTMLPullParser(events=('start',))
+    body = None
+
+    def flush(element):
+        # The text after an element is complete once the next element starts or the body ends
+        element_html = etree.tostring(element, encoding='unicode', method='html', with_tail=False)
+        tail = element.tail
+        body.remove(element)
+        yield element_html
+        if tail and tail.strip():
+            yield escape(tail)
+
+    def drain():
+        nonlocal body
+        for event, element in parser.read_events():
+            if body is None and element.tag == 'body':
+                body = element
+            elif body is not None and element.getparent() is body:
+                if body.text and body.text.strip():
+                    yield escape(body.text)
+                body.text = None
+                while body[0] is not element:
+                    yield from flush(body[0])
+
     with open(filing_html_path, 'r') as file:
-        html = file.read()
-    parser = sp.Edgar10QParser(get_steps=without_10q_related_steps)
-    elements: list = parser.parse(html)
-    tree: sp.SemanticTree = sp.TreeBuilder().build(elements)
-
-    filing_text = [node.text for node in tree.nodes if node.text]
-    return ' '.join(filing_text)
-    
\ No newline at end of file
+        for chunk in iter(lambda: file.read(read_chars), ''):
+            parser.feed(chunk)
+            yield from drain()
+    parser.close()
+    yield from drain()
+    if body is not None:
+        if body.text and body.text.strip():
+            yield escape(body.text)
+        while len(body):
+            yield from flush(body[0])
+
+def iter_filing_sections(filing_html_path, batch_chars=STREAMING_BATCH_CHARS):
+    """
+    Semantically parse a filing document into sections while it is being read.
+
+    The top-level elements are parsed in batches of about batch_chars characters, so neither the
+    whole document nor its whole element list is held in memory, and each section is yielded as
+    soon as it is complete. The steps of sec-parser only see one batch at a time, so headings and
+    merged text elements near the batch edges can come out slightly differently than with
+    streaming=False.
+
+    The pipeline itself collects every section before going on: context_builder.build_context()
+    ranks the passages with BM25 against statistics of the whole filing, and the parsed text cache
+    stores whole filings. Streaming bounds the memory of parsing, which is far larger than that of
+    the sections; it does not start the later stages earlier.
+
+    Args:
+        - filing_html_path (str): The path to the filing document.
+        - batch_chars (int): The approximate number of HTML characters parsed at a time.
+
+    Yields:
+        - dict: The sections of the filing in document order, as returned by parse_filing_sections().
+    """
+    parser = get_10k_parser()
+
+    def batches():
+        batch, size = [], 0
+        for html in iter_top_level_html(filing_html_path):
+            batch.append(html)
+            size += len(html)
+            if size >= batch_chars:
+                yield ''.join(batch)
+                batch, size = [], 0
+        if batch:
+            yield ''.join(batch)
+
+    def texts():
+        for batch in batches():
+            for element in parser.parse(batch):
+                yield element.text, _is_title(element)
+
+    yield from group_sections(texts())
+
+def parse_filing_sections(filing_html_path, use_cache=True, streaming=None):
+    """
+    Semantically parse a filing document into sections, one per heading.
+
+    Args:
+        - filing_html_path (str): The path to the filing document.
+        - use_cache (bool): Whether to reuse and store the parsed sections in the on-disk cache.
+        - streaming (bool): Whether to parse with iter_filing_sections(); None to stream only the
+          filings larger than STREAMING_THRESHOLD_BYTES.
+
+    Returns:
+        - list: The sections of the filing in document order, each a dict with the "title" of its
+          heading, the 10-K "item" it belongs to (e.g. "7" or "8", None before the first item)
+          and its "text", which starts with the heading itself.
+    """
+    if streaming is None:
+        streaming = os.path.getsize(filing_html_path) > STREAMING_THRESHOLD_BYTES
+
+    if use_cache:
+        key = text_cache.cache_key(hash_filing(filing_html_path), variant='streaming' if streaming else '')
+        cached_text = text_cache.load_text(key)
+        if cached_text is not None:
+            metrics.inc('cache_hits_total', cache='parsed_text')
+            return json.loads(cached_text)
+        metrics.inc('cache_misses_total', cache='parsed_text')
+
+    with metrics.span('parse'):
+        if streaming:
+            # The ranking of build_context() and the cache entry both need every section
+            sections = list(iter_filing_sections(filing_html_path))
+        else:
+            with open(filing_html_path, 'r') as file:
+                html = file.read()
+            # The nodes of the semantic tree are the elements in the same order, so the tree is not built
+            elements: list = get_10k_parser().parse(html)
+            sections = list(group_sections((element.text, _is_title(element)) for element in elements))
+
+    if use_cache:
+        text_cache.save_text(key, json.dumps(sections))
+    return sections
+
+def parse_filing_text(filing_html_path, use_cache=True, streaming=None):
+    """
+    Semantically parse a filing document into plain text.
+
+    Args:
+        - filing_html_path (str): The path to the filing document.
+        - use_cache (bool): Whether to reuse and store the parsed sections in the on-disk cache.
+        - streaming (bool): See parse_filing_sections().
+
+    Returns:
+        - str: The text of the filing.
+    """
+    return ' '.join(section["text"] for section in parse_filing_sections(filing_html_path, use_cache, streaming))
+
+def filing_context(filing_html_path, use_cache=True):
+    """
+    Parse a filing document and select the parts of it that are sent to the model.
+
+    Args:
+        - filing_html_path (str): The path to the filing document.
+        - use_cache (bool): Whether to reuse and store the parsed sections in the on-disk cache.
+
+    Returns:
+        - str: The context text for analyze().
+    """
+    return context_builder.build_context(parse_filing_sections(filing_html_path, use_cache))
@@ -0,0 +1,223 @@
+import os
+import re
+import time
+import random
+import atexit
+import asyncio
+import threading
+import collections
+import aiohttp
+from dotenv import load_dotenv
+import metrics
+
+API_URL = "https://api.anthropic.com/v1/complete"
+API_VERSION = "2023-06-01"
+
+MAX_CONCURRENCY = int(os.environ.get('ANTHROPIC_MAX_CONCURRENCY', 4))
+TOKENS_PER_MINUTE = int(os.environ.get('ANTHROPIC_TOKENS_PER_MINUTE', 400000))
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in a text.
+
+    Args:
+        - text (str): The text to measure.
+
+    Returns:
+        - int: The number of words and punctuation marks in the text, a close stand-in for its token count.
+    """
+    return sum(1 for _ in _TOKEN_PATTERN.finditer(text))
+
+_api_key = None
+
+def load_api_key():
+    """
+    Load the Anthropic API key, reading the .env file under the working directory only once.
+
+    Returns:
+        - str: The API key, or None if it is not set.
+    """
+    global _api_key
+    if _api_key is None:
+        load_dotenv(os.path.join(os.getcwd(), '.env'))
+        _api_key = os.environ.get('ANTHROPIC_API_KEY') or None
+    return _api_key
+
+class APIError(Exception):
+    """Raised when the API answers with an error that is not worth retrying, or retries run out."""
+
+    def __init__(self, status, body):
+        super().__init__(f"{status} - {body}")
+        self.status = status
+        self.body = body
+
+class TokenBudget:
+    """A sliding one-minute window of the tokens sent to the API."""
+
+    def __init__(self, tokens_per_minute):
+        self.tokens_per_minute = tokens_per_minute
+        self._sent = collections.deque()
+        self._used = 0
+        self._lock = None
+
+    async def acquire(self, tokens):
+        """
+        Wait until the given number of tokens fits in the budget of the last minute.
+
+        A single request larger than the whole budget is let through once the window is empty.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0][0] >= 60:
+                    self._used -= self._sent.popleft()[1]
+                if self._used + tokens <= self.tokens_per_minute:
+                    self._sent.append((now, tokens))
+                    self._used += tokens
+                    return
+                await asyncio.sleep(60 - (now - self._sent[0][0]))
+
+class AnthropicClient:
+    """
+    Asynchronous client for the Anthropic completions API.
+
+    Connections are pooled in one session, at most `max_concurrency` requests are in flight,
+    429 and 5xx responses are retried with exponential backoff, and requests wait for room
+    in a per-minute token budget.
+    """
+
+    def __init__(self, api_url=API_URL, api_key=None, max_concurrency=MAX_CONCURRENCY,
+                 tokens_per_minute=TOKENS_PER_MINUTE, max_retries=5, timeout=300,
+                 backoff_base=1.0, backoff_max=60.0):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget = TokenBudget(tokens_per_minute)
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={
+                    "Content-Type": "application/json",
+                    "X-API-Key": self.api_key or load_api_key() or "",
+                    "anthropic-version": API_VERSION
+                })
+        return self._session
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.backoff_base * 2 ** attempt, self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def complete(self, payload):
+        """
+        Send a completion request.
+
+        Args:
+            - payload (dict): The request body.
+
+        Returns:
+            - str: The completion text.
+
+        Raises:
+            - APIError: If the API returns a non-retryable error or the retries run out.
+        """
+        session = self._get_session()
+        prompt_tokens = estimate_tokens(payload["prompt"])
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            # Every attempt sends the whole prompt again, so every attempt is charged to the budget
+            await self.budget.acquire(prompt_tokens + payload.get("max_tokens_to_sample", 0))
+            metrics.inc('llm_tokens_sent_total', prompt_tokens)
+            try:
+                async with self._semaphore:
+                    async with session.post(self.api_url, json=payload) as response:
+                        if response.status == 200:
+                            return (await response.json())["completion"]
+                        body = await response.text()
+                        if response.status != 429 and response.status < 500:
+                            raise APIError(response.status, body)
+                        error = APIError(response.status, body)
+                        retry_after = response.headers.get("retry-after")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = APIError(None, repr(e))
+
+            if attempt == self.max_retries:
+                raise error
+            metrics.inc('llm_retries_total', reason=str(error.status or 'network'))
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+
+_loop = None
+_clients = {}
+_lock = threading.Lock()
+
+def _background_loop():
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='anthropic-client', daemon=True).start()
+    return _loop
+
+def get_client(api_url=API_URL):
+    """
+    Get the client shared by all synchronous callers in this process for the given API URL.
+
+    Args:
+        - api_url (str): The URL of the Anthropic API.
+
+    Returns:
+        - AnthropicClient: The shared client.
+    """
+    with _lock:
+        if api_url not in _clients:
+            _clients[api_url] = AnthropicClient(api_url=api_url)
+        return _clients[api_url]
+
+@atexit.register
+def _close_clients():
+    if _loop is not None:
+        for client in list(_clients.values()):
+            run_sync(client.close())
+
+def run_sync(coro):
+    """
+    Run a coroutine on the event loop of the shared clients and wait for its result.
+
+    Args:
+        - coro: The coroutine to run.
+
+    Returns:
+        - The result of the coroutine.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
@@ -1,13 +1,51 @@
-from flask import Flask, request, jsonify, send_from_directory
-import subprocess
+from flask import Flask, Response, request, jsonify, send_from_directory
 import os
+import json
+import time
+import hashlib
+import threading
+from fetch_10k import download_10k_filings
+from visualize import generate_insights
+from jobs import JobQueue
+from compare import generate_comparison
+import metrics
 
 app = Flask(__name__, static_url_path='', static_folder='frontend')
+job_queue = JobQueue()
+
+# A directory changed this recently may still change within the same mtime tick, so its listing is not cached
+LISTING_SETTLE_NS = 1_000_000_000
+# (ticker, kind) -> (mtime of the directory, plot files, ETag)
+_listings = {}
+_listings_lock = threading.Lock()
+# Seconds between the keep-alive comments of an idle event stream, which also notice closed connections
+EVENTS_KEEPALIVE_SECONDS = 15
 
 @app.route('/')
 def serve_frontend():
     return send_from_directory('frontend', 'index.html')
 
+def run_insight_job(job, company, email, ticker, from_year, to_year):
+    """
+    Fetch the 10-K filings of a ticker, then analyze them and render the plots, recording progress on the job.
+
+    Every plot is announced with a "plot" event as soon as it is on disk.
+    """
+    def on_plot(name, seconds):
+        kind, file_name = name.split('/', 1)
+        job.emit('plot', {'kind': kind, 'title': file_name[:-4], 'path': f'visualizations/{ticker}/{name}',
+                          'rendered': seconds is not None})
+
+    # Fetch the 10-K filings
+    job.update('fetch', 'running')
+    if download_10k_filings(company, email, ticker, from_year, to_year) is None:
+        job.update('fetch', 'failed')
+        raise RuntimeError('Error fetching 10-K filings')
+    job.update('fetch', 'done')
+
+    # Perform text analysis and visualization
+    generate_insights(ticker, from_year, to_year, progress=job.update, on_plot=on_plot)
+
 @app.route('/generate-insight', methods=['POST'])
 def generate_insight():
     data = request.get_json()
@@ -17,65 +55,132 @@ def generate_insight():
     from_year = int(data['fromYear'])
     to_year = int(data['toYear'])
 
-    # Fetch the 10-K filings
-    try:
-        command = f'python fetch_10k.py --company="{company}" --email="{email}" --ticker="{ticker}" --start_year={from_year} --end_year={to_year}'
-        subprocess.run(command, check=True, shell=True)
-        
-    except subprocess.CalledProcessError as e:
-        return jsonify({'error': 'Error fetching 10-K filings: ' + str(e)}), 500
+    job = job_queue.submit((ticker, from_year, to_year), run_insight_job, company, email, ticker, from_year, to_year)
+    return jsonify({'job_id': job.id, 'status_url': f'/jobs/{job.id}', 'events_url': f'/jobs/{job.id}/events'}), 202
 
-    # Perform text analysis and visualization
-    try:
-        command = f'python visualize.py --ticker="{ticker}" --start_year={from_year} --end_year={to_year}'
-        print(command)
-        subprocess.run(command, check=True, shell=True)
-        
-    except Exception as e:
-        return jsonify({'error': 'Error generating insight: ' + str(e)}), 500
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    """
+    Stream the events of a job as server-sent events, from the first one or after Last-Event-ID.
+
+    The stream ends with the "done" or "failed" event. While it waits for the next event, the
+    request thread sleeps on the job instead of polling it.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    start = 0 if last_event_id is None else last_event_id + 1
+    if job.status in ('done', 'failed') and start >= len(job.events):
+        # No Content tells the browser to stop reconnecting
+        return '', 204
+
+    def stream(start):
+        while True:
+            events = job.wait_events(start, EVENTS_KEEPALIVE_SECONDS)
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for index, event, data in events:
+                yield f'id: {index}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
+                if event in ('done', 'failed'):
+                    return
+            start = events[-1][0] + 1
+
+    response = Response(stream(start), mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    # Proxies must pass every event on as it comes
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
-    # Return the path to the generated visualization
-    return jsonify({'success': 'Visualization generated successfully'}), 200
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/compare', methods=['GET'])
+def compare_tickers():
+    tickers = [ticker.strip().upper() for ticker in request.args.get('tickers', '').split(',') if ticker.strip()]
+    from_year = request.args.get('fromYear', type=int)
+    to_year = request.args.get('toYear', type=int)
+
+    result = generate_comparison(tickers or None, from_year, to_year)
+    if not result['years']:
+        return jsonify({'error': 'No insights for these tickers and years', **result}), 404
+    return jsonify(result)
 
 @app.route('/visualizations/<path:path>')
 def serve_visualizations(path):
-    return send_from_directory('visualizations', path)
+    # Conditional responses: the ETag and Last-Modified follow the PNG, which is replaced on every redraw
+    return send_from_directory('visualizations', path, conditional=True, etag=True)
+
+def list_plots(ticker, kind):
+    """
+    List the plots of a ticker, reusing the last listing until the directory changes.
+
+    The render step writes every PNG to a temporary file and moves it into place, and removes
+    the plots that are no longer wanted, so the modification time of the directory changes
+    whenever it writes new plots. Checking it costs one stat instead of a directory scan.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+        - kind: The plot directory, "insights" or "detailed"
+
+    Returns:
+        - A (plot_files, etag, mtime) tuple, or None if the directory does not exist
+    """
+    visualization_path = f'visualizations/{ticker}/{kind}'
+    try:
+        mtime = os.stat(visualization_path).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    with _listings_lock:
+        cached = _listings.get((ticker, kind))
+    if cached is not None and cached[0] == mtime:
+        metrics.inc('cache_hits_total', cache='plot_listing')
+        return cached[1], cached[2], mtime
+    metrics.inc('cache_misses_total', cache='plot_listing')
 
-@app.route('/get-plots', methods=['GET'])
-def get_plots():
-    ticker = request.args.get('ticker')
-    visualization_path = f'visualizations/{ticker}/insights'
-    
-    if not os.path.exists(visualization_path):
-        return jsonify([]), 404
-    
     plot_files = []
-    for file_name in os.listdir(visualization_path):
+    for file_name in sorted(os.listdir(visualization_path)):
         if file_name.endswith('.png'):
             plot_files.append({
                 'title': file_name[:-4],  # Remove the '.png' extension
-                'path': f'visualizations/{ticker}/insights/{file_name}'  # Update the path to include the ticker and file name
+                'path': f'visualizations/{ticker}/{kind}/{file_name}'
             })
-    
-    return jsonify(plot_files)
+    etag = hashlib.sha256(json.dumps(plot_files).encode()).hexdigest()[:32]
+    if time.time_ns() - mtime > LISTING_SETTLE_NS:
+        with _listings_lock:
+            _listings[(ticker, kind)] = (mtime, plot_files, etag)
+    return plot_files, etag, mtime
+
+def plots_response(ticker, kind):
+    """
+    Answer a listing request with the plots of a ticker, or 304 Not Modified if the client has them.
+    """
+    listing = list_plots(ticker, kind)
+    if listing is None:
+        return jsonify([]), 404
+    plot_files, etag, mtime = listing
+    response = jsonify(plot_files)
+    response.set_etag(etag)
+    response.last_modified = mtime / 1e9
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/get-plots', methods=['GET'])
+def get_plots():
+    return plots_response(request.args.get('ticker'), 'insights')
 
 @app.route('/get-detailed-plots', methods=['GET'])
 def get_detailed_plots():
-    ticker = request.args.get('ticker')
-    visualization_path = f'visualizations/{ticker}/detailed'
-    
-    if not os.path.exists(visualization_path):
-        return jsonify([]), 404
-    
-    plot_files = []
-    for file_name in sorted(os.listdir(visualization_path)):
-        if file_name.endswith('.png'):
-            plot_files.append({
-                'title': file_name[:-4],  # Remove the '.png' extension
-                'path': f'visualizations/{ticker}/detailed/{file_name}'
-            })
-    print(jsonify(plot_files))
-    return jsonify(plot_files)
+    return plots_response(request.args.get('ticker'), 'detailed')
 
 if __name__ == '__main__':
     app.run(port=5000)
\ No newline at end of file
@@ -0,0 +1,186 @@
+import os
+import json
+import logging
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from fetch_10k import download_10k_filings, shared_downloader, FilingIndex
+from visualize import generate_insights
+
+CHECKPOINT_PATH = 'batch_checkpoint.json'
+
+def read_tickers(tickers=None, tickers_file=None):
+    """
+    Collect the tickers of a batch from a comma-separated list and/or a file.
+
+    Args:
+        - tickers: Comma-separated tickers, e.g. "META,AAPL", or None
+        - tickers_file: A file with one ticker per line, where blank lines and lines starting
+          with "#" are ignored, or None
+
+    Returns:
+        - The tickers in upper case and in the given order, without duplicates
+    """
+    names = (tickers or '').split(',')
+    if tickers_file:
+        with open(tickers_file, 'r') as f:
+            names += [line.split('#')[0] for line in f]
+    seen = []
+    for name in names:
+        name = name.strip().upper()
+        if name and name not in seen:
+            seen.append(name)
+    return seen
+
+class Checkpoint:
+    """
+    The progress of a batch, saved after every finished stage of a ticker so that an interrupted
+    run resumes where it stopped.
+
+    Progress is kept per ticker and stage ("fetch", then "insights"). Within a ticker, the filings
+    that were already analyzed are not analyzed again anyway, since their analyses are saved as
+    they complete, and the plots that are up to date are not redrawn.
+    """
+
+    def __init__(self, path, start_year, end_year, restart=False):
+        self.path = path
+        self.years = [start_year, end_year]
+        self._lock = threading.Lock()
+        self.tickers = {}
+        if not restart and os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('years') == self.years:
+                self.tickers = data.get('tickers', {})
+            else:
+                print(f"Checkpoint {path} is for the years {data.get('years')}, starting over")
+
+    def is_done(self, ticker, stage):
+        with self._lock:
+            return self.tickers.get(ticker, {}).get(stage) == 'done'
+
+    def mark(self, ticker, stage, status, **details):
+        """
+        Record the status of a stage of a ticker and save the checkpoint.
+
+        Args:
+            - ticker: The company's stock ticker symbol
+            - stage: "fetch" or "insights"
+            - status: "done", "incomplete" (to be run again) or "failed"
+            - details: Extra fields to keep, e.g. failed_years
+
+        Returns:
+            - None
+        """
+        with self._lock:
+            entry = self.tickers.setdefault(ticker, {})
+            entry[stage] = status
+            entry.update(details)
+            entry['updated'] = datetime.now().isoformat(timespec='seconds')
+            with open(f'{self.path}.tmp', 'w') as f:
+                json.dump({'years': self.years, 'tickers': self.tickers}, f, indent=4, sort_keys=True)
+            os.replace(f'{self.path}.tmp', self.path)
+
+def run_batch(tickers, start_year, end_year, company_name, email_address, checkpoint, ticker_workers=4,
+              parse_workers=1, analyze_workers=1, render_workers=1, downloader=None):
+    """
+    Fetch, analyze and render several tickers at once, all of them sharing the same worker pools.
+
+    Every ticker goes through its stages on its own thread, so one ticker's filings are being
+    downloaded while another's are parsed, analyzed or rendered. The parse and render process
+    pools and the LLM thread pool are started once for the whole batch, and all requests to
+    EDGAR share one downloader and its rate limiter.
+
+    Args:
+        - tickers: The company tickers
+        - start_year: The first filing year
+        - end_year: The last filing year
+        - company_name: The company name sent in the SEC user agent
+        - email_address: The email address sent in the SEC user agent
+        - checkpoint: The Checkpoint of the batch; tickers whose stages are done are skipped
+        - ticker_workers: The number of tickers in progress at the same time
+        - parse_workers: The number of processes used to parse filings
+        - analyze_workers: The number of concurrent LLM calls
+        - render_workers: The number of processes used to render plots
+        - downloader: See download_10k_filings()
+
+    Returns:
+        - A dictionary mapping each ticker to the status of its insights
+    """
+    index = FilingIndex()
+    get_downloader = shared_downloader(company_name, email_address, downloader)
+
+    def run_ticker(ticker, parse_pool, analyze_pool, render_pool):
+        if not checkpoint.is_done(ticker, 'fetch'):
+            if download_10k_filings(company_name, email_address, ticker, start_year, end_year,
+                                    get_downloader, index) is None:
+                checkpoint.mark(ticker, 'fetch', 'failed')
+                return 'failed'
+            checkpoint.mark(ticker, 'fetch', 'done')
+        if checkpoint.is_done(ticker, 'insights'):
+            return 'done'
+
+        insights = generate_insights(ticker, start_year, end_year, parse_pool=parse_pool,
+                                     analyze_pool=analyze_pool, render_pool=render_pool)
+        failed_years = [year for year, analysis in insights.items() if analysis is None]
+        status = 'incomplete' if failed_years else 'done'
+        checkpoint.mark(ticker, 'insights', status, filings=len(insights), failed_years=failed_years)
+        return status
+
+    pending = [ticker for ticker in tickers if not checkpoint.is_done(ticker, 'insights')]
+    results = {ticker: 'done' for ticker in tickers if ticker not in pending}
+    if results:
+        print(f"Skipping {len(results)} tickers finished in a previous run: {', '.join(results)}")
+    if not pending:
+        return results
+
+    with ProcessPoolExecutor(max_workers=max(parse_workers, 1)) as parse_pool, \
+            ThreadPoolExecutor(max_workers=max(analyze_workers, 1)) as analyze_pool, \
+            ProcessPoolExecutor(max_workers=max(render_workers, 1)) as render_pool, \
+            ThreadPoolExecutor(max_workers=max(ticker_workers, 1)) as ticker_pool:
+        futures = {ticker_pool.submit(run_ticker, ticker, parse_pool, analyze_pool, render_pool): ticker
+                   for ticker in pending}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                results[ticker] = future.result()
+            except Exception as e:
+                print(f"Error processing {ticker}: {e}")
+                checkpoint.mark(ticker, 'insights', 'failed', error=str(e))
+                results[ticker] = 'failed'
+            print(f"{ticker}: {results[ticker]}")
+
+    return {ticker: results[ticker] for ticker in tickers}
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch, analyze and render the 10-K filings of many tickers in one run")
+    parser.add_argument('--tickers', type=str, default=None, help="Comma-separated tickers")
+    parser.add_argument('--tickers_file', type=str, default=None, help="A file with one ticker per line")
+    parser.add_argument('--company', type=str, help="The company name sent in the SEC user agent")
+    parser.add_argument('--email', type=str, help="The email address sent in the SEC user agent")
+    parser.add_argument('--start_year', type=int, help="The start year for analysis")
+    parser.add_argument('--end_year', type=int, help="The end year for analysis")
+    parser.add_argument('--ticker_workers', type=int, default=4, help="The number of tickers in progress at the same time")
+    parser.add_argument('--parse_workers', type=int, default=os.cpu_count(), help="The number of processes used to parse filings")
+    parser.add_argument('--analyze_workers', type=int, default=4, help="The number of concurrent LLM calls")
+    parser.add_argument('--render_workers', type=int, default=os.cpu_count(), help="The number of processes used to render plots")
+    parser.add_argument('--checkpoint', type=str, default=CHECKPOINT_PATH, help="The file the progress is saved to and resumed from")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and process every ticker again")
+    parser.add_argument('--verbose', action='store_true', help="Log completions, analyses and render timings")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    tickers = read_tickers(args.tickers, args.tickers_file)
+    if not tickers:
+        parser.error("no tickers given, use --tickers and/or --tickers_file")
+    checkpoint = Checkpoint(args.checkpoint, args.start_year, args.end_year, args.restart)
+    results = run_batch(tickers, args.start_year, args.end_year, args.company, args.email, checkpoint,
+                        args.ticker_workers, args.parse_workers, args.analyze_workers, args.render_workers)
+
+    failed = [ticker for ticker, status in results.items() if status != 'done']
+    print(f"{len(results) - len(failed)}/{len(results)} tickers done"
+          + (f", run again to resume: {', '.join(failed)}" if failed else ""))
+
+if __name__ == '__main__':
+    main()
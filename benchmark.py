@@ -0,0 +1,322 @@
+import io
+import os
+import json
+import time
+import random
+import asyncio
+import cProfile
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import contextlib
+from datetime import datetime
+from aiohttp import web
+import analyzer
+import visualize
+from fetch_10k import download_10k_filings, FilingIndex, LocalDirectoryDownloader
+from xbrl_extractor import extract_analysis
+
+# The stages of the pipeline, in the order they run
+STAGES = ['fetch', 'xbrl', 'parse', 'analyze', 'totals', 'bar_plots', 'segment_plots']
+
+_WORDS = ("the company revenue net income segment tax deferred foreign domestic assets liabilities rate "
+          "million billion risk market product customers growth operations results").split()
+
+def write_fixture_filings(root, ticker, start_year, end_year, paragraphs=300, seed=0):
+    """
+    Write synthetic 10-K filings in the layout of sec-edgar-downloader.
+
+    Each filing has the usual items, with the income tax note and a few tables in Item 8, and no
+    inline XBRL facts, so that every stage of the pipeline has work to do.
+
+    Args:
+        - root: The directory the {ticker}/10-K/{accession}/primary-document.html files are written under
+        - ticker: The ticker of the filings
+        - start_year: The first filing year
+        - end_year: The last filing year
+        - paragraphs: The number of paragraphs of each filing
+        - seed: The seed of the random text
+
+    Returns:
+        - None
+    """
+    rng = random.Random(seed)
+    items = [("1", "Business", 0.2), ("1A", "Risk Factors", 0.3), ("7", "Management's Discussion and Analysis of "
+             "Financial Condition and Results of Operations", 0.2), ("7A", "Quantitative and Qualitative "
+             "Disclosures About Market Risk", 0.05), ("8", "Financial Statements and Supplementary Data", 0.25)]
+    for year in range(start_year, end_year + 1):
+        parts = []
+        for item, title, share in items:
+            parts.append(f'<div><span style="font-weight:700">Item {item}. {title}</span></div>')
+            for k in range(max(1, int(paragraphs * share))):
+                if k % 20 == 0:
+                    parts.append(f'<div><span style="font-weight:700">{title} overview {k // 20 + 1}</span></div>')
+                parts.append('<div><span style="font-size:10pt">'
+                             + ' '.join(rng.choice(_WORDS) for _ in range(100)) + '</span></div>')
+                if item == "8" and k % 25 == 0:
+                    parts.append('<table>' + ''.join('<tr>' + ''.join(f'<td>{rng.randint(1, 999)},{rng.randint(100, 999)}</td>'
+                                                                       for _ in range(5)) + '</tr>' for _ in range(10)) + '</table>')
+            if item == "8":
+                parts.append('<div><span style="font-weight:700">Note 14. Income Taxes</span></div>')
+                parts.append(f'<div><span>The effective income tax rate was {rng.randint(5, 25)}.{rng.randint(0, 9)}%.</span></div>')
+        accession = f'0000000000-{year % 100:02d}-{year:06d}'
+        filing_dir = os.path.join(root, ticker, '10-K', accession)
+        os.makedirs(filing_dir, exist_ok=True)
+        with open(os.path.join(filing_dir, 'primary-document.html'), 'w') as f:
+            f.write('<html><head><title>10-K</title></head><body>' + ''.join(parts) + '</body></html>')
+
+class FakeAnthropic:
+    """
+    A local stand-in for the Anthropic completions API, served from a background thread.
+
+    Every request waits `latency` seconds and is answered with a well-formed analysis of
+    made-up values.
+    """
+
+    def __init__(self, latency=0.2, seed=0):
+        self.latency = latency
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+        self.url = None
+
+    async def _complete(self, request):
+        await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        value = lambda: f"${self._rng.uniform(0.1, 50):.2f} billion"
+        completion = json.dumps({
+            "Revenue": {"Products": value(), "Services": value()},
+            "Net Income": {"Products": value(), "Services": value()},
+            "Effective Tax Rate": f"{self._rng.uniform(5, 25):.1f}%",
+            "Deferred Tax Assets": value(),
+            "Deferred Tax Liabilities": value(),
+            "Foreign Income Percentage": f"{self._rng.uniform(10, 90):.0f}%"
+        })
+        return web.json_response({"completion": completion})
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post('/v1/complete', self._complete)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}/v1/complete'
+
+    def __enter__(self):
+        threading.Thread(target=self._loop.run_forever, name='fake-anthropic', daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+def _reset_peak_rss():
+    # Linux resets the peak RSS of a process when "5" is written to its clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class StageRecorder:
+    """Measures the wall time, CPU time and peak RSS of every run of a stage, optionally under cProfile."""
+
+    def __init__(self, profile=False):
+        self.records = []
+        self.profilers = {} if profile else None
+        self.peak_resets = _reset_peak_rss()
+
+    @contextlib.contextmanager
+    def measure(self, stage, item):
+        profiler = None if self.profilers is None else self.profilers.setdefault(stage, cProfile.Profile())
+        _reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            # The pipeline prints its progress, which would drown the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield
+        finally:
+            if profiler:
+                profiler.disable()
+            self.records.append({
+                'stage': stage,
+                'item': item,
+                'wall': time.perf_counter() - wall,
+                'cpu': time.process_time() - cpu,
+                'peak_rss_mb': _peak_rss_mb()
+            })
+
+    def summary(self):
+        """
+        Sum up the records of each stage.
+
+        Returns:
+            - A dictionary mapping each stage to its "runs", total "wall" and "cpu" seconds and the
+              largest "peak_rss_mb" of its runs
+        """
+        stages = {}
+        for record in self.records:
+            stage = stages.setdefault(record['stage'], {'runs': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_rss_mb': 0.0})
+            stage['runs'] += 1
+            stage['wall'] += record['wall']
+            stage['cpu'] += record['cpu']
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'], record['peak_rss_mb'])
+        return {stage: stages[stage] for stage in STAGES if stage in stages}
+
+    def dump_profiles(self, profile_dir):
+        os.makedirs(profile_dir, exist_ok=True)
+        for stage, profiler in self.profilers.items():
+            profiler.dump_stats(os.path.join(profile_dir, f'{stage}.prof'))
+
+def run_pipeline(recorder, fixtures_dir, tickers, start_year, end_year, api_url):
+    """
+    Run every stage of the pipeline on the fixture filings, in the working directory.
+
+    Args:
+        - recorder: The StageRecorder that measures the stages
+        - fixtures_dir: The directory the fake EDGAR serves filings from
+        - tickers: The tickers to run
+        - start_year: The first filing year
+        - end_year: The last filing year
+        - api_url: The URL of the completions API
+
+    Returns:
+        - None
+    """
+    index = FilingIndex()
+    downloader = LocalDirectoryDownloader(fixtures_dir, 'data')
+    for ticker in tickers:
+        with recorder.measure('fetch', ticker):
+            download_10k_filings('Benchmark', 'benchmark@example.com', ticker, start_year, end_year, downloader, index)
+
+        insights = {}
+        for filing_year, filing_path in visualize.collect_filings(ticker, start_year, end_year):
+            item = f'{ticker}/{filing_year}'
+            with recorder.measure('xbrl', item):
+                extracted = extract_analysis(filing_path)
+            with recorder.measure('parse', item):
+                filing_text = analyzer.filing_context(filing_path, use_cache=False)
+            with recorder.measure('analyze', item):
+                analysis = analyzer.analyze(filing_text, api_url=api_url, use_cache=False)
+            insights[filing_year] = {**(analysis or {}), **extracted}
+            with recorder.measure('totals', item):
+                visualize.extract_total_values(insights[filing_year])
+
+        with recorder.measure('bar_plots', ticker):
+            visualize.create_bar_plot(ticker, insights)
+        with recorder.measure('segment_plots', ticker):
+            visualize.create_segment_bar_plots(ticker, insights)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_history(history_path):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, 'r') as f:
+        return json.load(f)
+
+def save_history(history_path, history):
+    with open(f'{history_path}.tmp', 'w') as f:
+        json.dump(history, f, indent=4)
+    os.replace(f'{history_path}.tmp', history_path)
+
+def print_report(summary, previous=None):
+    """
+    Print the summary of each stage, with the change of its wall time since the previous run.
+
+    Args:
+        - summary: The summary returned by StageRecorder.summary()
+        - previous: The summary of the previous run, or None
+
+    Returns:
+        - None
+    """
+    print(f"{'stage':<14} {'runs':>5} {'wall s':>9} {'cpu s':>9} {'peak RSS MB':>12} {'wall vs prev':>13}")
+    for stage, result in summary.items():
+        change = ''
+        if previous and stage in previous and previous[stage]['wall'] > 0:
+            change = f"{(result['wall'] / previous[stage]['wall'] - 1) * 100:+.1f}%"
+        print(f"{stage:<14} {result['runs']:>5} {result['wall']:>9.3f} {result['cpu']:>9.3f} "
+              f"{result['peak_rss_mb']:>12.1f} {change:>13}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fetch, parse, analyze and render stages of the pipeline")
+    parser.add_argument('--tickers', type=str, default='BNCH', help="Comma-separated tickers to run")
+    parser.add_argument('--start_year', type=int, default=2015, help="The first filing year")
+    parser.add_argument('--end_year', type=int, default=2024, help="The last filing year")
+    parser.add_argument('--fixtures', type=str, default=None,
+                        help="A {ticker}/10-K/{accession}/primary-document.html tree to serve, e.g. data/sec-edgar-filings; "
+                             "synthetic filings are generated when omitted")
+    parser.add_argument('--paragraphs', type=int, default=300, help="The number of paragraphs of each synthetic filing")
+    parser.add_argument('--llm_latency', type=float, default=0.2, help="The seconds the fake API takes to answer")
+    parser.add_argument('--history', type=str, default='benchmark_history.json', help="The JSON file the runs are appended to")
+    parser.add_argument('--profile_dir', type=str, default=None, help="Write a cProfile dump of each stage to this directory")
+    parser.add_argument('--label', type=str, default=None, help="A label stored with the run")
+    args = parser.parse_args()
+
+    tickers = [ticker.strip() for ticker in args.tickers.split(',') if ticker.strip()]
+    history_path = os.path.abspath(args.history)
+    profile_dir = os.path.abspath(args.profile_dir) if args.profile_dir else None
+    fixtures_dir = os.path.abspath(args.fixtures) if args.fixtures else None
+    recorder = StageRecorder(profile=profile_dir is not None)
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark')
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as work_dir, FakeAnthropic(args.llm_latency) as api:
+        if fixtures_dir is None:
+            fixtures_dir = os.path.join(work_dir, 'fixtures')
+            for seed, ticker in enumerate(tickers):
+                write_fixture_filings(fixtures_dir, ticker, args.start_year, args.end_year, args.paragraphs, seed)
+        os.chdir(work_dir)
+        try:
+            run_pipeline(recorder, fixtures_dir, tickers, args.start_year, args.end_year, api.url)
+        finally:
+            os.chdir(cwd)
+
+    summary = recorder.summary()
+    history = load_history(history_path)
+    print_report(summary, history[-1]['stages'] if history else None)
+    if not recorder.peak_resets:
+        print("The peak RSS cannot be reset per stage here, so it is the peak of the process so far")
+
+    history.append({
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'label': args.label,
+        'args': vars(args),
+        'stages': summary,
+        'records': recorder.records
+    })
+    save_history(history_path, history)
+    print(f"Appended the run to {history_path}")
+    if profile_dir:
+        recorder.dump_profiles(profile_dir)
+        print(f"Wrote the profile of each stage to {profile_dir}, e.g. for snakeviz or flameprof")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import hashlib
+import argparse
+import warnings
+import numpy as np
+import render
+from insights_store import InsightsStore
+
+# The metrics loaded from the store for a comparison
+METRICS = ['Revenue', 'Net Income', 'Effective Tax Rate', 'Foreign Income Percentage']
+# Compared series -> its unit, all of them in percent
+SERIES = {
+    'Effective Tax Rate': '%',
+    'Revenue Growth': '% YoY',
+    'Net Income Growth': '% YoY',
+    'Foreign Income Share': '%',
+}
+
+def load_panel(tickers=None, start_year=None, end_year=None, store=None):
+    """
+    Load the totals of the compared metrics of many tickers into arrays aligned on fiscal year.
+
+    Args:
+        - tickers: The tickers to compare, or None for every ticker in the store
+        - start_year: The first year to include, or None
+        - end_year: The last year to include, or None
+        - store: The InsightsStore to read, or None for the default store
+
+    Returns:
+        - A (tickers, years, panel) tuple: the panel maps each metric in METRICS to a ticker by year
+          grid, holding NaN where a ticker has no value for a year. Only the years in which at
+          least one of the tickers has a value are kept, in increasing order.
+    """
+    store = (store or InsightsStore()).load()
+    tickers = list(store.vocab['tickers']) if tickers is None else list(tickers)
+    years = np.unique(np.asarray(store.columns['year'], dtype=np.int64))
+    if start_year is not None:
+        years = years[years >= int(start_year)]
+    if end_year is not None:
+        years = years[years <= int(end_year)]
+
+    panel = {metric: store.totals(metric, tickers, years.tolist())[2] for metric in METRICS}
+    if not tickers:
+        return tickers, [], {metric: grid[:, :0] for metric, grid in panel.items()}
+    present = np.any(np.stack([~np.isnan(grid) for grid in panel.values()]), axis=(0, 1))
+    return tickers, years[present].tolist(), {metric: grid[:, present] for metric, grid in panel.items()}
+
+def yoy_growth(grid, years):
+    """
+    Compute the year-over-year growth of every row of a ticker by year grid.
+
+    Args:
+        - grid: A ticker by year array of values
+        - years: The increasing years of the columns of the grid
+
+    Returns:
+        - An array of the same shape with the growth in percent of the absolute previous value,
+          NaN for the first year, after a gap in the years and when either value is missing or zero
+    """
+    growth = np.full(grid.shape, np.nan)
+    if grid.shape[1] < 2:
+        return growth
+    previous = grid[:, :-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = (grid[:, 1:] - previous) / np.abs(previous) * 100
+    change[:, np.diff(np.asarray(years)) != 1] = np.nan
+    growth[:, 1:] = np.where(np.isfinite(change), change, np.nan)
+    return growth
+
+def compare(tickers, years, panel):
+    """
+    Compute the compared series of every ticker and their peer aggregates for every year.
+
+    Args:
+        - tickers, years, panel: As returned by load_panel()
+
+    Returns:
+        - A (series, aggregates) tuple: series maps each name in SERIES to its ticker by year grid;
+          aggregates maps each name to a dictionary of year arrays with the "median", the "p25"
+          and "p75" percentiles and the "count" of tickers with a value
+    """
+    series = {
+        'Effective Tax Rate': panel['Effective Tax Rate'],
+        'Revenue Growth': yoy_growth(panel['Revenue'], years),
+        'Net Income Growth': yoy_growth(panel['Net Income'], years),
+        'Foreign Income Share': panel['Foreign Income Percentage'],
+    }
+    aggregates = {}
+    for name, grid in series.items():
+        with warnings.catch_warnings():
+            # Years without any value have NaN aggregates
+            warnings.simplefilter('ignore', RuntimeWarning)
+            p25, median, p75 = np.nanpercentile(grid, [25, 50, 75], axis=0) if grid.size else np.full((3, len(years)), np.nan)
+        aggregates[name] = {'median': median, 'p25': p25, 'p75': p75, 'count': np.sum(~np.isnan(grid), axis=0)}
+    return series, aggregates
+
+def to_list(values):
+    """Convert an array to a JSON-friendly list, with None for NaN."""
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isnan(values), None, np.round(values, 4)).tolist()
+
+def comparison_plots(tickers, years, series, aggregates):
+    """
+    Describe the peer comparison charts, one per compared series.
+
+    Args:
+        - tickers, years: As returned by load_panel()
+        - series, aggregates: As returned by compare()
+
+    Returns:
+        - A dictionary mapping each plot path under the comparison directory to its (draw function name, inputs)
+    """
+    return {f'comparison/{name}.png': ('peer_lines', (name, SERIES[name], years, tickers, to_list(grid),
+                                                     to_list(aggregates[name]['p25']), to_list(aggregates[name]['median']),
+                                                     to_list(aggregates[name]['p75'])))
+            for name, grid in series.items()}
+
+def comparison_dir(tickers, years):
+    """The directory under "visualizations" of the charts of a comparison, named after its tickers and years."""
+    digest = hashlib.sha256(f"{','.join(sorted(tickers))}:{years[0] if years else ''}-{years[-1] if years else ''}".encode())
+    return f'compare-{digest.hexdigest()[:16]}'
+
+def generate_comparison(tickers=None, start_year=None, end_year=None, store=None, workers=1):
+    """
+    Compare many tickers and render the comparison charts.
+
+    Args:
+        - tickers: The tickers to compare, or None for every ticker in the store
+        - start_year: The first year to include, or None
+        - end_year: The last year to include, or None
+        - store: The InsightsStore to read, or None for the default store
+        - workers: The number of processes used to render the charts
+
+    Returns:
+        - A dictionary with the compared "tickers", the "missing" tickers without any value, the
+          "years", the peer "aggregates" of each series as lists with None for missing values,
+          and the "plots" as a list of {"title", "path"}
+    """
+    # The year before the first one is loaded too, for the growth of the first year
+    tickers, years, panel = load_panel(tickers, None if start_year is None else start_year - 1, end_year, store)
+    series, aggregates = compare(tickers, years, panel)
+    if start_year is not None and years and years[0] < start_year:
+        years = years[1:]
+        panel = {metric: grid[:, 1:] for metric, grid in panel.items()}
+        series = {name: grid[:, 1:] for name, grid in series.items()}
+        aggregates = {name: {key: values[1:] for key, values in stats.items()} for name, stats in aggregates.items()}
+    has_values = np.any(np.stack([~np.isnan(grid) for grid in panel.values()]), axis=(0, 2)) if tickers else np.zeros(0, bool)
+
+    plots = {}
+    directory = comparison_dir(tickers, years)
+    if years:
+        plotted = [row for row, present in enumerate(has_values) if present]
+        plots = comparison_plots([tickers[row] for row in plotted], years,
+                                 {name: grid[plotted] for name, grid in series.items()}, aggregates)
+        render.render_plots(directory, plots, ['comparison'], workers)
+    return {
+        'tickers': tickers,
+        'missing': [ticker for ticker, present in zip(tickers, has_values) if not present],
+        'years': years,
+        'aggregates': {name: {key: to_list(values) if key != 'count' else values.tolist() for key, values in stats.items()}
+                       for name, stats in aggregates.items()},
+        'plots': [{'title': name[len('comparison/'):-4], 'path': f'visualizations/{directory}/{name}'} for name in plots],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the insights of many tickers against their peers")
+    parser.add_argument('--tickers', type=str, default=None, help="Comma-separated tickers, all tickers in the store if omitted")
+    parser.add_argument('--start_year', type=int, default=None, help="The first year to include")
+    parser.add_argument('--end_year', type=int, default=None, help="The last year to include")
+    parser.add_argument('--render_workers', type=int, default=1, help="The number of processes used to render the charts")
+    args = parser.parse_args()
+
+    tickers = [ticker.strip() for ticker in args.tickers.split(',') if ticker.strip()] if args.tickers else None
+    result = generate_comparison(tickers, args.start_year, args.end_year, workers=args.render_workers)
+    if result['missing']:
+        print(f"No insights for {', '.join(result['missing'])}")
+    for name, stats in result['aggregates'].items():
+        print(f"{name} ({SERIES[name]}), peer median by year:")
+        for year, median, count in zip(result['years'], stats['median'], stats['count']):
+            print(f"    {year}: {'-' if median is None else f'{median:.2f}'} ({count} tickers)")
+    for plot in result['plots']:
+        print(plot['path'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+import re
+import json
+from value_parser import parse_value
+
+# Main field of the analysis -> the kind of value it holds
+ANALYSIS_SCHEMA = {
+    "Revenue": "segments",
+    "Net Income": "segments",
+    "Effective Tax Rate": "percent",
+    "Deferred Tax Assets": "money",
+    "Deferred Tax Liabilities": "money",
+    "Foreign Income Percentage": "percent",
+}
+
+_LITERALS = {'true': 'true', 'false': 'false', 'null': 'null', 'True': 'true', 'False': 'false', 'None': 'null'}
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?$')
+# A quoted key right after a string, as in '"$1 billion" "Graphics": ...' with a missing comma
+_NEXT_KEY = re.compile(r'["\'][^"\'\n]*["\']\s*:')
+_STRING_ESCAPES = {'"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+def _read_string(text, i):
+    """
+    Read a single- or double-quoted string starting at text[i].
+
+    A quote of the same kind only ends the string when it is followed by a delimiter, so
+    apostrophes and unescaped inner quotes are kept as part of the string.
+
+    Returns:
+        - tuple: (the string as a JSON string literal, the index after it, whether the string was closed)
+    """
+    quote = text[i]
+    out = []
+    j = i + 1
+    while j < len(text):
+        char = text[j]
+        if char == '\\' and j + 1 < len(text):
+            escaped = text[j + 1]
+            if escaped == "'":
+                out.append("'")
+            elif escaped in '"\\/bfnrt':
+                out.append('\\' + escaped)
+            elif escaped == 'u' and re.match(r'[0-9a-fA-F]{4}', text[j + 2:j + 6]):
+                out.append(text[j:j + 6])
+                j += 4
+            else:
+                out.append('\\\\' + escaped)
+            j += 2
+            continue
+        if char == quote:
+            rest = text[j + 1:].lstrip(' \t')
+            if not rest or rest[0] in ',:}]\r\n' or _NEXT_KEY.match(rest):
+                return '"' + ''.join(out) + '"', j + 1, True
+        if char in _STRING_ESCAPES:
+            out.append(_STRING_ESCAPES[char])
+        elif ord(char) < 0x20:
+            out.append(f'\\u{ord(char):04x}')
+        else:
+            out.append(char)
+        j += 1
+    # The completion ended inside the string
+    return '"' + ''.join(out) + '"', j, False
+
+def _read_bare(text, i, stops):
+    """Read an unquoted token up to one of the stop characters and turn it into a JSON token."""
+    j = i
+    while j < len(text) and text[j] not in stops:
+        j += 1
+    word = text[i:j].strip()
+    if word in _LITERALS:
+        return _LITERALS[word], j
+    if _NUMBER.match(word):
+        return word, j
+    return json.dumps(word), j
+
+def _close(tokens, stack):
+    """Close the innermost container, dropping a trailing comma or a key left without a value."""
+    container, expect = stack.pop()
+    if expect == 'value' and tokens[-1] == ':':
+        tokens.pop()
+        expect = 'colon'
+    if expect == 'colon':
+        tokens.pop()
+    if tokens[-1] == ',':
+        tokens.pop()
+    tokens.append('}' if container == '{' else ']')
+
+def repair_json(text):
+    """
+    Extract the first JSON object of a completion and repair the usual mistakes of a model.
+
+    The object is scanned incrementally: prose before and after it is ignored, single quotes,
+    unquoted keys and bare values are quoted, missing commas are inserted, trailing commas
+    are dropped, and a completion cut off in the middle is closed, leaving out a key that
+    never got its value.
+
+    Args:
+        - text (str): The completion.
+
+    Returns:
+        - str: The repaired JSON, or None if the completion has no object.
+    """
+    i = text.find('{')
+    if i < 0:
+        return None
+    tokens = []
+    # Each open container and what it expects next: "key", "colon", "value" or "next"
+    stack = []
+    while i < len(text):
+        char = text[i]
+        if char.isspace():
+            i += 1
+            continue
+        if not stack and tokens:
+            break
+        state = stack[-1] if stack else None
+
+        if char in '}]':
+            if stack:
+                _close(tokens, stack)
+            i += 1
+            continue
+        if state and state[1] == 'colon':
+            tokens.append(':')
+            state[1] = 'value'
+            if char == ':':
+                i += 1
+            continue
+        if char in ',:':
+            if char == ',' and state and state[1] == 'next':
+                tokens.append(',')
+                state[1] = 'key' if state[0] == '{' else 'value'
+            i += 1
+            continue
+        if state and state[1] == 'next':
+            # A new key or value without a comma before it
+            tokens.append(',')
+            state[1] = 'key' if state[0] == '{' else 'value'
+            continue
+
+        if state and state[1] == 'key':
+            if char in '"\'':
+                token, i, _ = _read_string(text, i)
+            elif char in '{[':
+                i += 1
+                continue
+            else:
+                token, i = _read_bare(text, i, ':,}\n')
+                token = token if token.startswith('"') else json.dumps(token)
+            tokens.append(token)
+            state[1] = 'colon'
+            continue
+
+        if char in '{[':
+            tokens.append(char)
+            if state:
+                state[1] = 'next'
+            stack.append([char, 'key' if char == '{' else 'value'])
+            i += 1
+            continue
+        if char in '"\'':
+            token, i, closed = _read_string(text, i)
+            if not closed:
+                # A value cut off by the end of the completion is not trusted
+                break
+        else:
+            token, i = _read_bare(text, i, ',}]\n')
+        tokens.append(token)
+        state[1] = 'next'
+
+    while stack:
+        _close(tokens, stack)
+    return ''.join(tokens)
+
+def parse_json(text):
+    """
+    Parse the JSON object of a completion, repairing it when it is not valid as it is.
+
+    Args:
+        - text (str): The completion.
+
+    Returns:
+        - dict: The parsed object, or None if no object could be recovered.
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        repaired = repair_json(text)
+        if repaired is None:
+            return None
+        try:
+            data = json.loads(repaired)
+        except json.JSONDecodeError:
+            return None
+    return data if isinstance(data, dict) else None
+
+def _valid_value(value, kind):
+    """Return the value as an analysis string if it is valid for its kind, else None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        value = f"{value}%" if kind == 'percent' else f"${value} billion"
+    if not isinstance(value, str):
+        return None
+    parsed = parse_value(value)
+    if parsed is None:
+        return None
+    return value
+
+def validate_analysis(data, fields=None):
+    """
+    Check a parsed analysis against the schema of the main fields.
+
+    Args:
+        - data (dict): The parsed completion.
+        - fields (list): The main fields that were asked for, or None for all of them.
+
+    Returns:
+        - tuple: (analysis, missing_fields). The analysis keeps the valid main fields, with numbers
+          turned into strings and segments without a value dropped, and every other field as it
+          is. missing_fields lists the requested main fields that are absent or invalid.
+    """
+    fields = list(ANALYSIS_SCHEMA) if fields is None else list(fields)
+    analysis = {}
+    for key, value in data.items():
+        kind = ANALYSIS_SCHEMA.get(key)
+        if kind is None:
+            analysis[key] = value
+        elif kind == 'segments' and isinstance(value, dict):
+            segments = {name: _valid_value(segment, 'money') for name, segment in value.items()}
+            segments = {name: segment for name, segment in segments.items() if segment is not None}
+            if segments:
+                analysis[key] = segments
+        else:
+            valid = _valid_value(value, 'money' if kind == 'segments' else kind)
+            if valid is not None:
+                analysis[key] = valid
+    return analysis, [field for field in fields if field not in analysis]
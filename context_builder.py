@@ -0,0 +1,160 @@
+import os
+import re
+import math
+from collections import Counter
+from anthropic_client import estimate_tokens
+
+# Token budget of the filing context sent with the prompt
+CONTEXT_TOKENS = int(os.environ.get('CONTEXT_TOKENS', 16000))
+# Passages longer than this are split so that they can be ranked and packed separately
+PASSAGE_TOKENS = 400
+
+# Terms of the prompt used to rank the passages that are not selected up front
+QUERY = ("revenue revenues segment segments net income loss effective tax rate provision for income taxes "
+         "deferred tax assets liabilities valuation allowance foreign domestic international "
+         "income before provision for income taxes statutory rate")
+
+_ITEM_PATTERN = re.compile(r'^\s*item\s*(\d+[a-c]?)\b', re.IGNORECASE)
+_TAX_TITLE_PATTERN = re.compile(r'income\s+tax', re.IGNORECASE)
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_TERM_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Items selected before any ranking: MD&A and the financial statements
+PRIORITY_ITEMS = {'7', '8'}
+
+def item_number(title):
+    """
+    Extract the 10-K item number from a heading.
+
+    Args:
+        - title (str): The heading text, e.g. "Item 7. Management's Discussion and Analysis".
+
+    Returns:
+        - str: The lower-cased item number, e.g. "7" or "1a", or None if the heading is not an item heading.
+    """
+    match = _ITEM_PATTERN.match(title)
+    return match.group(1).lower() if match else None
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Cut a text after the given number of tokens.
+
+    Args:
+        - text (str): The text to cut.
+        - max_tokens (int): The maximum number of tokens to keep.
+
+    Returns:
+        - str: The text, shortened if it has more than max_tokens tokens.
+    """
+    for count, match in enumerate(_TOKEN_PATTERN.finditer(text)):
+        if count == max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+def split_passages(sections, passage_tokens=PASSAGE_TOKENS):
+    """
+    Split the sections of a filing into passages of at most roughly passage_tokens tokens.
+
+    Args:
+        - sections (list): The sections returned by analyzer.parse_filing_sections().
+        - passage_tokens (int): The target size of a passage.
+
+    Returns:
+        - list: The passages in document order, each a dict with the "title" and "item" of its
+          section, its "text" and its "tokens" count, heading included.
+    """
+    passages = []
+    for section in sections:
+        # Passages after the first one of a section are sent with the heading repeated in front
+        heading_tokens = 0
+        chunk, chunk_tokens = [], 0
+        for word in section["text"].split():
+            word_tokens = estimate_tokens(word)
+            if chunk and chunk_tokens + word_tokens > passage_tokens:
+                passages.append({"title": section["title"], "item": section["item"],
+                                 "text": ' '.join(chunk), "tokens": heading_tokens + chunk_tokens})
+                heading_tokens = estimate_tokens(section["title"])
+                chunk, chunk_tokens = [], 0
+            chunk.append(word)
+            chunk_tokens += word_tokens
+        if chunk:
+            passages.append({"title": section["title"], "item": section["item"],
+                             "text": ' '.join(chunk), "tokens": heading_tokens + chunk_tokens})
+    return passages
+
+def bm25_scores(documents, query, k1=1.5, b=0.75):
+    """
+    Score documents against a query with Okapi BM25.
+
+    Args:
+        - documents (list): The texts to score.
+        - query (str): The query text.
+        - k1 (float): The term frequency saturation.
+        - b (float): The document length normalization.
+
+    Returns:
+        - list: The score of each document.
+    """
+    if not documents:
+        return []
+    term_counts = [Counter(_TERM_PATTERN.findall(document.lower())) for document in documents]
+    lengths = [sum(counts.values()) for counts in term_counts]
+    average_length = sum(lengths) / len(lengths) or 1
+    query_terms = set(_TERM_PATTERN.findall(query.lower()))
+    document_frequency = {term: sum(1 for counts in term_counts if term in counts) for term in query_terms}
+
+    scores = []
+    for counts, length in zip(term_counts, lengths):
+        score = 0.0
+        for term in query_terms:
+            frequency = counts.get(term, 0)
+            if not frequency:
+                continue
+            idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average_length))
+        scores.append(score)
+    return scores
+
+def build_context(sections, token_budget=CONTEXT_TOKENS, query=QUERY):
+    """
+    Select the parts of a filing that are sent to the model and pack them into a token budget.
+
+    Passages are taken in three tiers: the income tax footnotes first, then MD&A (Item 7) and
+    the financial statements (Item 8), then everything else. Within a tier the passages are
+    ranked by their BM25 score against the terms of the prompt, and passages are added until
+    the budget is used up. The selected passages are returned in document order.
+
+    Args:
+        - sections (list): The sections returned by analyzer.parse_filing_sections().
+        - token_budget (int): The maximum number of tokens of the context.
+        - query (str): The text the passages are ranked against.
+
+    Returns:
+        - str: The context text.
+    """
+    passages = split_passages(sections)
+    scores = bm25_scores([passage["title"] + ' ' + passage["text"] for passage in passages], query)
+
+    def tier(passage):
+        if _TAX_TITLE_PATTERN.search(passage["title"]):
+            return 0
+        if passage["item"] in PRIORITY_ITEMS:
+            return 1
+        return 2
+
+    ranking = sorted(range(len(passages)), key=lambda i: (tier(passages[i]), -scores[i], i))
+    selected, used_tokens = [], 0
+    for i in ranking:
+        if used_tokens + passages[i]["tokens"] > token_budget:
+            continue
+        selected.append(i)
+        used_tokens += passages[i]["tokens"]
+
+    context, previous_title = [], None
+    for i in sorted(selected):
+        passage = passages[i]
+        if passage["title"] != previous_title and not passage["text"].startswith(passage["title"]):
+            context.append(passage["title"])
+        context.append(passage["text"])
+        previous_title = passage["title"]
+    return '\n\n'.join(context)
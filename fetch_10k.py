@@ -1,39 +1,322 @@
 import os
+import re
+import json
+import shutil
+import tempfile
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from sec_edgar_downloader import Downloader
+import metrics
+import file_lock
 import argparse
 
-def download_10k_filings(company_name, email_address, ticker, start_year = None, end_year = None):
+FILINGS_DIR = os.path.join('data', 'sec-edgar-filings')
+# First year with electronic filings on EDGAR, used when no start year is given
+EDGAR_FIRST_YEAR = 1994
+
+def get_year(folder_name):
+    """
+    Extract the year from the folder name.
+
+    Args:
+        - folder_name: The name of the folder containing the filing
+
+    Returns:
+        - The year as a string
+    """
+    # Use regular expression to extract the year part from the folder name
+    match = re.search(r'-(\d{2})-', folder_name)
+    if match:
+        year = int(match.group(1))
+        if year > 80:
+            year += 1900
+        else:
+            year += 2000
+    else:
+        return None
+
+    return str(year)
+
+class FilingIndex:
+    """
+    Index of the downloaded 10-K filings, keyed by accession number, with their ticker and fiscal year.
+
+    It also remembers which past years of a ticker were already requested without returning
+    a filing, so that they are not requested again. The index is saved as index.json next to
+    the filings and is safe to share between threads. Several instances, in one process or
+    many, can save the same index: each save merges its changes into the saved index.
+    """
+
+    def __init__(self, filings_dir=FILINGS_DIR):
+        self.filings_dir = filings_dir
+        self.index_path = os.path.join(filings_dir, 'index.json')
+        self._lock = threading.Lock()
+        self.filings, self.checked = self._read()
+        # Accessions removed by scan(), which a save must not bring back from the saved index
+        self._removed = set()
+
+    def _read(self):
+        if not os.path.exists(self.index_path):
+            return {}, {}
+        with open(self.index_path, 'r') as f:
+            data = json.load(f)
+        return data.get('filings', {}), data.get('checked', {})
+
+    def scan(self, ticker):
+        """
+        Bring the entries of a ticker in line with the filings on disk.
+
+        Args:
+            - ticker: The company's stock ticker symbol
+
+        Returns:
+            - None
+        """
+        ticker_dir = os.path.join(self.filings_dir, ticker, '10-K')
+        on_disk = {}
+        if os.path.isdir(ticker_dir):
+            for accession in os.listdir(ticker_dir):
+                if os.path.exists(os.path.join(ticker_dir, accession, 'primary-document.html')):
+                    on_disk[accession] = {'ticker': ticker, 'fiscal_year': get_year(accession)}
+        with self._lock:
+            for accession in [accession for accession, entry in self.filings.items()
+                              if entry['ticker'] == ticker and accession not in on_disk]:
+                del self.filings[accession]
+                self._removed.add(accession)
+            self.filings.update(on_disk)
+            self._removed -= set(on_disk)
+
+    def accessions(self, ticker):
+        with self._lock:
+            return {accession for accession, entry in self.filings.items() if entry['ticker'] == ticker}
+
+    def years(self, ticker):
+        with self._lock:
+            return {int(entry['fiscal_year']) for entry in self.filings.values() if entry['ticker'] == ticker}
+
+    def is_checked(self, ticker, year):
+        with self._lock:
+            return str(year) in self.checked.get(ticker, [])
+
+    def mark_checked(self, ticker, year):
+        with self._lock:
+            years = self.checked.setdefault(ticker, [])
+            if str(year) not in years:
+                years.append(str(year))
+
+    def save(self):
+        """
+        Merge the index into the saved one and save the result.
+
+        The saved index is read again under a lock of the filings directory, so the filings and
+        checked years that other instances saved in the meantime are kept.
+
+        Returns:
+            - None
+        """
+        with self._lock, file_lock.locked(os.path.join(self.filings_dir, '.index.lock')):
+            saved_filings, saved_checked = self._read()
+            self.filings = {**{accession: entry for accession, entry in saved_filings.items()
+                               if accession not in self._removed}, **self.filings}
+            for ticker, years in saved_checked.items():
+                checked = self.checked.setdefault(ticker, [])
+                checked.extend(year for year in years if year not in checked)
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.filings_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'filings': self.filings, 'checked': self.checked}, f, indent=4, sort_keys=True)
+                os.replace(tmp_path, self.index_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+class LocalDirectoryDownloader:
+    """
+    Stand-in for sec_edgar_downloader.Downloader that copies filings from a local directory.
+
+    The source directory has the same {ticker}/10-K/{accession}/ layout as the download folder.
+    """
+
+    def __init__(self, source_dir, download_folder):
+        self.source_dir = source_dir
+        self.download_folder = download_folder
+
+    def get(self, form, ticker, *, limit=None, after=None, before=None, include_amends=False,
+            download_details=True, accession_numbers_to_skip=None):
+        source_dir = os.path.join(self.source_dir, ticker, form)
+        if not os.path.isdir(source_dir):
+            return 0
+        num_filings = 0
+        for accession in sorted(os.listdir(source_dir)):
+            year = int(get_year(accession))
+            if accession in (accession_numbers_to_skip or set()):
+                continue
+            if (after and year < after.year) or (before and year >= before.year):
+                continue
+            shutil.copytree(os.path.join(source_dir, accession),
+                            os.path.join(self.download_folder, 'sec-edgar-filings', ticker, form, accession),
+                            dirs_exist_ok=True)
+            num_filings += 1
+            if limit and num_filings >= limit:
+                break
+        return num_filings
+
+def missing_year_ranges(years):
+    """
+    Group years into contiguous (first, last) ranges.
+
+    Args:
+        - years: A sorted list of years
+
+    Returns:
+        - A list of (first, last) tuples
+    """
+    ranges = []
+    for year in years:
+        if ranges and ranges[-1][1] == year - 1:
+            ranges[-1] = (ranges[-1][0], year)
+        else:
+            ranges.append((year, year))
+    return ranges
+
+def download_10k_filings(company_name, email_address, ticker, start_year = None, end_year = None, downloader=None, index=None):
+    """
+    Download the 10-K filings of a ticker that are not already on disk.
+
+    The local filing index is checked first, and only the years without a filing are requested,
+    skipping the accession numbers that are already downloaded. A run over years that are all
+    present makes no request at all.
+
+    Args:
+        - company_name: The company name sent in the SEC user agent
+        - email_address: The email address sent in the SEC user agent
+        - ticker: The company ticker
+        - start_year: The first filing year to download, or None for the first year on EDGAR
+        - end_year: The last filing year to download, or None for the current year
+        - downloader: An object with the get() method of sec_edgar_downloader.Downloader, or a
+          callable returning one; by default a Downloader for the data directory is created when needed
+        - index: The FilingIndex to use, e.g. one shared between threads
+
+    Returns:
+        - The number of downloaded filings, or None if the download failed
+    """
     # Create a directory to store the downloaded files
     data_dir = f"data"
     os.makedirs(data_dir, exist_ok=True)
+    index = index or FilingIndex(os.path.join(data_dir, 'sec-edgar-filings'))
+    index.scan(ticker)
 
-    # Initialize the Downloader
-    dl = Downloader(company_name, email_address, os.path.join(os.getcwd(), data_dir))
-
-    # Convert start_year to a datetime object
-    start_date = datetime(start_year, 1, 1)
+    current_year = datetime.now().year
+    start_year = start_year or EDGAR_FIRST_YEAR
+    end_year = end_year or current_year
+    present_years = index.years(ticker)
+    missing_years = [year for year in range(start_year, end_year + 1)
+                     if year not in present_years and not index.is_checked(ticker, year)]
+    if not missing_years:
+        print(f"All 10-K filings for {ticker} from {start_year} to {end_year} are already downloaded")
+        metrics.inc('cache_hits_total', cache='filings')
+        return 0
+    metrics.inc('cache_misses_total', cache='filings')
 
     try:
-        # Download the 10-K filings from the start_date until the end_year
-        num_filings = dl.get("10-K", ticker, limit=None, after=start_date, before=datetime(end_year + 1, 1, 1) if end_year else None, include_amends=False, download_details=True)
-        print(f"Downloaded {num_filings} 10-K filings for {ticker} from {start_year if start_year else 'the earliest available'} to {end_year if end_year else 'the latest available'}")
+        # Initialize the Downloader only when something is missing, since it looks up the ticker mapping
+        if downloader is None:
+            downloader = Downloader(company_name, email_address, os.path.join(os.getcwd(), data_dir))
+        elif callable(downloader):
+            downloader = downloader()
+
+        num_filings = 0
+        with metrics.span('fetch'):
+            for first_year, last_year in missing_year_ranges(missing_years):
+                num_filings += downloader.get("10-K", ticker, limit=None, after=datetime(first_year, 1, 1), before=datetime(last_year + 1, 1, 1), include_amends=False, download_details=True, accession_numbers_to_skip=index.accessions(ticker))
+        print(f"Downloaded {num_filings} 10-K filings for {ticker} from {start_year} to {end_year}")
 
     except Exception as e:
         print(f"Error downloading or cleaning 10-K filings for {ticker}: {e}")
+        return None
+
+    # Past years that still have no filing are not requested again
+    index.scan(ticker)
+    present_years = index.years(ticker)
+    for year in missing_years:
+        if year < current_year and year not in present_years:
+            index.mark_checked(ticker, year)
+    index.save()
+    return num_filings
+
+def shared_downloader(company_name, email_address, downloader=None):
+    """
+    Build a callable that creates one downloader on first use and returns it to every thread.
+
+    Args:
+        - company_name: The company name sent in the SEC user agent
+        - email_address: The email address sent in the SEC user agent
+        - downloader: See download_10k_filings()
+
+    Returns:
+        - A callable returning the shared downloader, to pass as the downloader of download_10k_filings()
+    """
+    lock = threading.Lock()
+    shared = {}
+
+    def get_downloader():
+        with lock:
+            if 'downloader' not in shared:
+                if downloader is None:
+                    shared['downloader'] = Downloader(company_name, email_address, os.path.join(os.getcwd(), 'data'))
+                else:
+                    shared['downloader'] = downloader() if callable(downloader) else downloader
+            return shared['downloader']
+    return get_downloader
+
+def download_many(company_name, email_address, tickers, start_year = None, end_year = None, workers=4, downloader=None):
+    """
+    Download the missing 10-K filings of several tickers concurrently.
+
+    All tickers share one filing index and one Downloader. Every request the Downloader sends
+    to the SEC goes through sec-edgar-downloader's process-wide limiter of 10 requests per
+    second, so the threads together stay within the SEC fair access policy.
+
+    Args:
+        - company_name: The company name sent in the SEC user agent
+        - email_address: The email address sent in the SEC user agent
+        - tickers: The company tickers
+        - start_year: The first filing year to download
+        - end_year: The last filing year to download, or None for the current year
+        - workers: The number of tickers downloaded at the same time
+        - downloader: See download_10k_filings()
+
+    Returns:
+        - A dictionary mapping each ticker to its number of downloaded filings, or None if its download failed
+    """
+    index = FilingIndex()
+    get_downloader = shared_downloader(company_name, email_address, downloader)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {ticker: executor.submit(download_10k_filings, company_name, email_address, ticker,
+                                           start_year, end_year, get_downloader, index)
+                   for ticker in tickers}
+        return {ticker: future.result() for ticker, future in futures.items()}
 
 def main():
     args = parse_args()
-    download_10k_filings(args.company, args.email, args.ticker, args.start_year, args.end_year)
+    tickers = [ticker.strip() for ticker in args.ticker.split(',') if ticker.strip()]
+    if len(tickers) == 1:
+        download_10k_filings(args.company, args.email, tickers[0], args.start_year, args.end_year)
+    else:
+        download_many(args.company, args.email, tickers, args.start_year, args.end_year, args.workers)
     return 0
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Download 10-K filings for a company")
     parser.add_argument("--company", type=str, help="The company name")
     parser.add_argument("--email", type=str, help="The email address")
-    parser.add_argument("--ticker", type=str, help="The company ticker")
+    parser.add_argument("--ticker", type=str, help="The company ticker, or several comma-separated tickers")
     parser.add_argument("--start_year", type=int, default=None, help="The start year")
     parser.add_argument("--end_year", type=int, default=None, help="The end year")
+    parser.add_argument("--workers", type=int, default=4, help="The number of tickers downloaded concurrently")
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl; locks fall back to creating the lock file exclusively
+    fcntl = None
+
+# Seconds between attempts to take a lock file held by another process, without fcntl
+POLL_SECONDS = 0.05
+
+@contextmanager
+def locked(lock_path):
+    """
+    Hold an exclusive lock shared by every thread and process that uses the same lock file.
+
+    Usage:
+        with file_lock.locked('visualizations/META/.lock'):
+            ...
+
+    With fcntl, the lock is an flock on the file, released by the system if the process dies.
+    Elsewhere, the lock is the existence of the file, created with O_CREAT | O_EXCL and removed
+    on release; a process that dies while holding it leaves the file behind, to be removed by hand.
+
+    Args:
+        - lock_path: The path of the lock file, whose directory is created if needed
+
+    Returns:
+        - A context manager holding the lock for the duration of its block
+    """
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    if fcntl is not None:
+        with open(lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            time.sleep(POLL_SECONDS)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
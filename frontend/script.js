@@ -30,10 +30,12 @@ document.getElementById("insightForm").addEventListener("submit", function(event
     const fromYear = document.getElementById("fromYear").value;
     const toYear = document.getElementById("toYear").value;
 
-    // Show loading message
+    // Show loading message and clear the plots of the previous run
     document.getElementById("loading").style.display = "block";
+    document.getElementById("insightsContainer").innerHTML = "";
+    document.getElementById("detailedInsightsContainer").innerHTML = "";
 
-    // Make an API request to the backend
+    // Make an API request to the backend to start the job
     fetch("/generate-insight", {
         method: "POST",
         headers: {
@@ -43,13 +45,20 @@ document.getElementById("insightForm").addEventListener("submit", function(event
     })
     .then(response => response.json())
     .then(data => {
+        if (data.error) {
+            throw new Error(data.error);
+        }
+        // Without server-sent events, the job is polled and the plots are fetched once it is done
+        return window.EventSource ? streamJob(data.events_url, data.status_url) : pollJob(data.status_url);
+    })
+    .then(job => {
         // Hide loading message
         document.getElementById("loading").style.display = "none";
 
-        if (data.error) {
+        if (job.status === "failed") {
             // Display error message
-            alert("Error: " + data.error);
-        } else {
+            alert("Error: " + job.error);
+        } else if (!job.streamed) {
             // Show the buttons
             document.getElementById("buttons").style.display = "block";
 
@@ -87,6 +96,85 @@ document.getElementById("insightForm").addEventListener("submit", function(event
     });
 });
 
+// Poll the job status until it is finished, showing the progress of each stage
+function pollJob(statusUrl, interval = 2000) {
+    return fetch(statusUrl)
+        .then(response => response.json())
+        .then(job => {
+            showProgress(job);
+            if (job.status === "done" || job.status === "failed") {
+                return job;
+            }
+            return new Promise(resolve => setTimeout(resolve, interval))
+                .then(() => pollJob(statusUrl, interval));
+        });
+}
+
+// Follow the events of the job, showing its progress and each plot as soon as it is rendered
+function streamJob(eventsUrl, statusUrl) {
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(eventsUrl);
+        const job = { stages: {} };
+
+        source.addEventListener("progress", event => {
+            const update = JSON.parse(event.data);
+            const progress = job.stages[update.stage] = job.stages[update.stage] || { status: "running", years: {} };
+            if (update.year === null) {
+                progress.status = update.status;
+            } else {
+                progress.years[update.year] = update.status;
+            }
+            showProgress(job);
+        });
+        source.addEventListener("plot", event => showPlot(JSON.parse(event.data)));
+        ["done", "failed"].forEach(status => source.addEventListener(status, event => {
+            source.close();
+            resolve({ ...JSON.parse(event.data), streamed: true });
+        }));
+        source.onerror = () => {
+            // The browser reconnects by itself and resumes after the last event, unless the stream was refused
+            if (source.readyState === EventSource.CLOSED) {
+                pollJob(statusUrl).then(resolve, reject);
+            }
+        };
+    });
+}
+
+// Add a plot to its container in title order, or reload its image if it was redrawn
+function showPlot(plot) {
+    document.getElementById("buttons").style.display = "block";
+    const container = document.getElementById(plot.kind === "detailed" ? "detailedInsightsContainer" : "insightsContainer");
+    const src = plot.rendered ? `${plot.path}?v=${Date.now()}` : plot.path;
+    const plots = Array.from(container.children);
+
+    const existing = plots.find(element => element.dataset.path === plot.path);
+    if (existing) {
+        if (plot.rendered) {
+            existing.querySelector("img").src = src;
+        }
+        return;
+    }
+    const plotElement = document.createElement("div");
+    plotElement.dataset.path = plot.path;
+    plotElement.dataset.title = plot.title;
+    plotElement.innerHTML = `
+        <figure>
+            <img src="${src}" alt="${plot.title}">
+            <figcaption>${plot.title}</figcaption>
+        </figure>
+    `;
+    container.insertBefore(plotElement, plots.find(element => element.dataset.title > plot.title) || null);
+}
+
+function showProgress(job) {
+    const lines = Object.entries(job.stages || {}).map(([stage, progress]) => {
+        const years = Object.keys(progress.years);
+        const finished = years.filter(year => progress.years[year] !== "queued").length;
+        return years.length ? `${stage}: ${finished}/${years.length} years` : `${stage}: ${progress.status}`;
+    });
+    document.getElementById("progress").textContent = lines.join(" · ");
+}
+
 // Add event listener for the insights button
 document.getElementById("insightsBtn").addEventListener("click", function() {
     document.getElementById("insightsContainer").style.display = "block";
@@ -0,0 +1,271 @@
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+from value_parser import parse_analysis, BILLION, PERCENT
+import file_lock
+
+STORE_DIR = os.environ.get('INSIGHTS_STORE_DIR', 'store')
+
+# Column name -> dtype. Strings are stored as codes into the vocabularies in vocab.json.
+COLUMNS = {
+    'ticker': np.int32,
+    'year': np.int16,
+    'metric': np.int32,
+    'segment': np.int32,
+    'value': np.float64,
+    'unit': np.int8,
+}
+UNITS = [BILLION, PERCENT]
+# Segment of the metrics that are a single value, e.g. "Effective Tax Rate"
+NO_SEGMENT = ''
+
+class InsightsStore:
+    """
+    Columnar store of the normalized insight values of every ticker and year.
+
+    Each column is a .npy file that is memory-mapped on read, and every row is one value
+    indexed by (ticker, year, metric, segment). Writes build a new generation directory and
+    switch the CURRENT pointer to it, so readers always see a complete set of columns. The
+    previous generation is kept for readers that read CURRENT just before the switch, and a
+    reader that still finds its generation removed reads CURRENT again.
+    """
+
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+        self._generation = None
+        self._vocab = None
+        self._columns = None
+
+    def _write_lock(self):
+        return file_lock.locked(os.path.join(self.path, '.lock'))
+
+    def _current_generation(self):
+        try:
+            with open(os.path.join(self.path, 'CURRENT'), 'r') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """
+        Load the latest generation of the store, memory-mapping its columns.
+
+        Returns:
+            - The store itself
+        """
+        while True:
+            generation = self._current_generation()
+            if generation is not None and generation == self._generation:
+                return self
+            if generation is None:
+                self._vocab = {'tickers': [], 'metrics': [], 'segments': [NO_SEGMENT]}
+                self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+                self._generation = generation
+                return self
+
+            generation_dir = os.path.join(self.path, generation)
+            try:
+                with open(os.path.join(generation_dir, 'vocab.json'), 'r') as f:
+                    vocab = json.load(f)
+                columns = {name: np.load(os.path.join(generation_dir, f'{name}.npy'), mmap_mode='r')
+                           for name in COLUMNS}
+            except FileNotFoundError:
+                # Two writes happened since CURRENT was read, so the generation is already gone
+                continue
+            self._generation, self._vocab, self._columns = generation, vocab, columns
+            return self
+
+    @property
+    def vocab(self):
+        return self.load()._vocab
+
+    @property
+    def columns(self):
+        return self.load()._columns
+
+    def __len__(self):
+        return len(self.columns['value'])
+
+    def _write(self, vocab, columns):
+        current = self._current_generation()
+        generation = f'gen-{int(current[4:]) + 1 if current else 1:08d}'
+        generation_dir = os.path.join(self.path, generation)
+        os.makedirs(generation_dir, exist_ok=True)
+        with open(os.path.join(generation_dir, 'vocab.json'), 'w') as f:
+            json.dump(vocab, f)
+        for name, dtype in COLUMNS.items():
+            np.save(os.path.join(generation_dir, f'{name}.npy'), np.asarray(columns[name], dtype=dtype))
+
+        tmp_pointer = os.path.join(self.path, 'CURRENT.tmp')
+        with open(tmp_pointer, 'w') as f:
+            f.write(generation)
+        os.replace(tmp_pointer, os.path.join(self.path, 'CURRENT'))
+
+        # The previous generation is kept for readers that are about to open it; older ones stay
+        # readable through existing memory maps until they are unlinked
+        for name in os.listdir(self.path):
+            if name.startswith('gen-') and name not in (generation, current):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        self._generation = None
+
+    def append(self, ticker, analyses):
+        """
+        Add or replace the insights of a ticker for the given years.
+
+        Args:
+            - ticker: The company's stock ticker symbol
+            - analyses: A dictionary containing the analysis for each year; years whose analysis
+              is None are removed from the store
+
+        Returns:
+            - The number of rows written
+        """
+        with self._write_lock():
+            self._generation = None
+            vocab = {name: list(values) for name, values in self.vocab.items()}
+            codes = {name: {value: code for code, value in enumerate(values)} for name, values in vocab.items()}
+
+            def code(name, value):
+                if value not in codes[name]:
+                    codes[name][value] = len(vocab[name])
+                    vocab[name].append(value)
+                return codes[name][value]
+
+            ticker_code = code('tickers', ticker)
+            new_rows = {name: [] for name in COLUMNS}
+            for year, analysis in analyses.items():
+                if analysis is None:
+                    continue
+                for metric, value in parse_analysis(analysis).items():
+                    segments = value.items() if isinstance(value, dict) else [(NO_SEGMENT, value)]
+                    for segment, parsed_value in segments:
+                        new_rows['ticker'].append(ticker_code)
+                        new_rows['year'].append(int(year))
+                        new_rows['metric'].append(code('metrics', metric))
+                        new_rows['segment'].append(code('segments', segment))
+                        new_rows['value'].append(parsed_value.value)
+                        new_rows['unit'].append(UNITS.index(parsed_value.unit))
+
+            columns = self.columns
+            replaced = (columns['ticker'] == ticker_code) & np.isin(columns['year'], [int(year) for year in analyses])
+            self._write(vocab, {name: np.concatenate([columns[name][~replaced], np.asarray(new_rows[name], dtype=dtype)])
+                                for name, dtype in COLUMNS.items()})
+            return len(new_rows['value'])
+
+    def query(self, tickers=None, years=None, metrics=None, segments=None):
+        """
+        Select the rows matching the given filters.
+
+        Args:
+            - tickers: The tickers to keep, or None for all
+            - years: The years to keep, or None for all
+            - metrics: The metrics to keep, or None for all
+            - segments: The segments to keep, or None for all
+
+        Returns:
+            - A dictionary of column arrays; "ticker", "metric", "segment" and "unit" are decoded to strings
+        """
+        columns = self.columns
+        mask = np.ones(len(columns['value']), dtype=bool)
+        for name, vocab_name, values in (('ticker', 'tickers', tickers), ('metric', 'metrics', metrics),
+                                         ('segment', 'segments', segments)):
+            if values is not None:
+                lookup = {value: code for code, value in enumerate(self.vocab[vocab_name])}
+                mask &= np.isin(columns[name], [lookup[value] for value in values if value in lookup])
+        if years is not None:
+            mask &= np.isin(columns['year'], [int(year) for year in years])
+
+        result = {name: np.asarray(columns[name][mask]) for name in COLUMNS}
+        for name, vocab_name in (('ticker', 'tickers'), ('metric', 'metrics'), ('segment', 'segments')):
+            result[name] = np.asarray(self.vocab[vocab_name], dtype=object)[result[name]]
+        result['unit'] = np.asarray(UNITS, dtype=object)[result['unit']]
+        return result
+
+    def totals(self, metric, tickers=None, years=None):
+        """
+        Sum the segments of a metric into a ticker by year grid.
+
+        Args:
+            - metric: The metric, e.g. "Revenue"
+            - tickers: The tickers of the rows of the grid, or None for every ticker in the store
+            - years: The years of the columns of the grid, or None for every year in the store
+
+        Returns:
+            - A (tickers, years, grid) tuple, the grid holding NaN where a ticker has no value for a year
+        """
+        columns = self.columns
+        tickers = list(self.vocab['tickers']) if tickers is None else list(tickers)
+        if years is None:
+            years = sorted(set(np.asarray(columns['year']).tolist()))
+        years = [int(year) for year in years]
+
+        ticker_codes = {ticker: code for code, ticker in enumerate(self.vocab['tickers'])}
+        ticker_lookup = np.full(len(self.vocab['tickers']) + 1, -1)
+        for row, ticker in enumerate(tickers):
+            if ticker in ticker_codes:
+                ticker_lookup[ticker_codes[ticker]] = row
+        rows = ticker_lookup[np.asarray(columns['ticker'])]
+
+        year_array = np.asarray(years, dtype=np.int64)
+        order = np.argsort(year_array)
+        row_years = np.asarray(columns['year'], dtype=np.int64)
+        cols = order[np.clip(np.searchsorted(year_array[order], row_years), 0, len(years) - 1)] \
+            if years else np.zeros(len(row_years), dtype=np.int64)
+        year_matches = year_array[cols] == row_years if years else np.zeros(len(row_years), dtype=bool)
+
+        metric_code = self.vocab['metrics'].index(metric) if metric in self.vocab['metrics'] else -1
+        mask = (np.asarray(columns['metric']) == metric_code) & (rows >= 0) & year_matches
+
+        grid = np.zeros((len(tickers), len(years)))
+        seen = np.zeros((len(tickers), len(years)), dtype=bool)
+        np.add.at(grid, (rows[mask], cols[mask]), np.asarray(columns['value'])[mask])
+        seen[rows[mask], cols[mask]] = True
+        grid[~seen] = np.nan
+        return tickers, years, grid
+
+def import_tree(insights_dir='insights', store=None):
+    """
+    Import an existing tree of insights/{ticker}/{year}/analysis.json files into the store.
+
+    Args:
+        - insights_dir: The root of the insights tree
+        - store: The store to import into, or None for the default store
+
+    Returns:
+        - The number of rows written
+    """
+    store = store or InsightsStore()
+    rows = 0
+    for ticker in sorted(os.listdir(insights_dir)):
+        ticker_dir = os.path.join(insights_dir, ticker)
+        if not os.path.isdir(ticker_dir):
+            continue
+        analyses = {}
+        for year in sorted(os.listdir(ticker_dir)):
+            analysis_path = os.path.join(ticker_dir, year, 'analysis.json')
+            if year.isdigit() and os.path.exists(analysis_path):
+                with open(analysis_path, 'r') as f:
+                    analyses[year] = json.load(f)
+        if analyses:
+            rows += store.append(ticker, analyses)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the columnar insights store")
+    parser.add_argument('command', choices=['import', 'stats'], help="The action to perform")
+    parser.add_argument('--insights_dir', type=str, default='insights', help="The insights tree to import")
+    parser.add_argument('--store_dir', type=str, default=STORE_DIR, help="The store directory")
+    args = parser.parse_args()
+
+    store = InsightsStore(args.store_dir)
+    if args.command == 'import':
+        print(f"Imported {import_tree(args.insights_dir, store)} values into {args.store_dir}")
+    else:
+        print(f"rows: {len(store)}")
+        for name, values in store.vocab.items():
+            print(f"{name}: {len(values)}")
+
+if __name__ == '__main__':
+    main()
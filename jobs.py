@@ -0,0 +1,176 @@
+import os
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get('INSIGHT_JOB_WORKERS', 2))
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = int(os.environ.get('INSIGHT_JOB_TTL', 3600))
+
+class Job:
+    """
+    A unit of background work and its progress, broken down per stage and per year.
+
+    Every change is also appended to an event log, which subscribers read from any position
+    and wait on for new events, e.g. to stream them to the browser.
+    """
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'
+        self.error = None
+        self.stages = {}
+        self.created = time.time()
+        self.finished = None
+        self.events = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def emit(self, event, data):
+        """
+        Append an event to the log of the job and wake up its subscribers.
+
+        Args:
+            - event: The type of the event, e.g. "progress" or "plot"
+            - data: The JSON-serializable payload of the event
+
+        Returns:
+            - None
+        """
+        with self._lock:
+            self._emit(event, data)
+
+    def _emit(self, event, data):
+        self.events.append((event, data))
+        self._changed.notify_all()
+
+    def wait_events(self, start, timeout=None):
+        """
+        Get the events from a position of the log, waiting for one if there are none yet.
+
+        Args:
+            - start: The index of the first event to return
+            - timeout: The seconds to wait for a new event, or None to wait until there is one
+
+        Returns:
+            - A list of (index, event, data) tuples, empty if the timeout expired
+        """
+        with self._lock:
+            self._changed.wait_for(lambda: len(self.events) > start, timeout)
+            return [(index, event, data) for index, (event, data) in enumerate(self.events[start:], start)]
+
+    def update(self, stage, status, year=None):
+        """
+        Record the progress of a stage, or of one year of a stage.
+
+        Args:
+            - stage: The stage, e.g. "fetch", "parse", "analyze" or "render"
+            - status: The new status, e.g. "running", "done" or "failed"
+            - year: The year the status applies to, or None for the stage as a whole
+
+        Returns:
+            - None
+        """
+        with self._lock:
+            progress = self.stages.setdefault(stage, {'status': 'running', 'years': {}})
+            if year is None:
+                progress['status'] = status
+            else:
+                progress['years'][str(year)] = status
+            self._emit('progress', {'stage': stage, 'status': status, 'year': None if year is None else str(year)})
+
+    def finish(self, status, error=None):
+        """
+        Mark the job as done or failed, which is the last event of its log.
+
+        Args:
+            - status: "done" or "failed"
+            - error: The error message of a failed job
+
+        Returns:
+            - None
+        """
+        with self._lock:
+            self.status = status
+            self.error = error
+            self.finished = time.time()
+            self._emit(status, {'status': status, 'error': error})
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'key': list(self.key),
+                'status': self.status,
+                'error': self.error,
+                'stages': {stage: {'status': progress['status'], 'years': dict(progress['years'])}
+                           for stage, progress in self.stages.items()},
+                'created': self.created,
+                'finished': self.finished
+            }
+
+class JobQueue:
+    """
+    Runs jobs on a pool of worker threads inside the web process.
+
+    Jobs are de-duplicated by key: submitting a key whose job is still queued or running
+    returns that job instead of starting another one.
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='insight-job')
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Queue a job, or join the unfinished job with the same key.
+
+        Args:
+            - key: The de-duplication key of the job
+            - fn: The function to run; it receives the Job as its first argument
+            - args, kwargs: The other arguments of fn
+
+        Returns:
+            - The Job
+        """
+        with self._lock:
+            self._forget_finished()
+            job = self._active.get(key)
+            if job is not None:
+                return job
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._active[key] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        try:
+            fn(job, *args, **kwargs)
+            job.finish('done')
+        except Exception as e:
+            traceback.print_exc()
+            job.finish('failed', str(e))
+        finally:
+            with self._lock:
+                self._active.pop(job.key, None)
+
+    def _forget_finished(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.done and now - job.finished > JOB_TTL:
+                del self._jobs[job_id]
@@ -0,0 +1,205 @@
+import os
+import time
+import logging
+import threading
+
+# Set PIPELINE_METRICS_ENABLED=0 to turn spans and counters into no-ops
+ENABLED = os.environ.get('PIPELINE_METRICS_ENABLED', '1') != '0'
+PREFIX = 'sec_insights_'
+# Upper bounds in seconds of the buckets of the stage latency histogram
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Metric name -> (type, help)
+METRICS = {
+    'stage_seconds': ('histogram', "Time spent in each stage of the pipeline."),
+    'stage_errors_total': ('counter', "Stages that ended with an exception."),
+    'cache_hits_total': ('counter', "Lookups answered from a cache."),
+    'cache_misses_total': ('counter', "Lookups that missed a cache."),
+    'llm_retries_total': ('counter', "Completion requests sent again, by reason."),
+    'llm_tokens_sent_total': ('counter', "Estimated tokens sent to the completions API."),
+}
+
+logger = logging.getLogger('pipeline')
+
+_lock = threading.Lock()
+# (name, labels) -> value, labels being a sorted tuple of (label, value) pairs
+_counters = {}
+# labels -> [count of each bucket..., count above the last bucket, sum, count]
+_histograms = {}
+
+def _reset_after_fork():
+    # A forked worker starts empty, so that what it hands back to the parent is only its own
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    """
+    Add to a counter.
+
+    Args:
+        - name: The name of the counter in METRICS, e.g. "cache_hits_total"
+        - value: The amount to add
+        - labels: The labels of the series, e.g. cache="parsed_text"
+
+    Returns:
+        - None
+    """
+    if not ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(stage, seconds, failed=False):
+    """
+    Record the duration of one run of a stage.
+
+    Args:
+        - stage: The stage, e.g. "parse"
+        - seconds: The time the stage took
+        - failed: Whether the stage ended with an exception
+
+    Returns:
+        - None
+    """
+    if not ENABLED:
+        return
+    key = (('stage', stage),)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 3)
+        bucket = 0
+        while bucket < len(BUCKETS) and seconds > BUCKETS[bucket]:
+            bucket += 1
+        histogram[bucket] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+    if failed:
+        inc('stage_errors_total', stage=stage)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('stage finished', extra={'stage': stage, 'seconds': seconds, 'failed': failed})
+
+class _Span:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.stage, time.perf_counter() - self.start, failed=exc_type is not None)
+        return False
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(stage):
+    """
+    Time a stage of the pipeline.
+
+    Usage:
+        with metrics.span('parse'):
+            ...
+
+    Args:
+        - stage: The stage, e.g. "fetch", "parse", "llm_call", "json_decode" or "render"
+
+    Returns:
+        - A context manager recording the duration of its block, or a shared no-op one when metrics are disabled
+    """
+    return _Span(stage) if ENABLED else _NO_SPAN
+
+def drain():
+    """
+    Take the metrics recorded so far in this process and reset them.
+
+    Worker processes return this to the parent, which passes it to merge().
+
+    Returns:
+        - A (counters, histograms) tuple, or None when metrics are disabled
+    """
+    if not ENABLED:
+        return None
+    with _lock:
+        snapshot = (dict(_counters), {key: list(values) for key, values in _histograms.items()})
+        _counters.clear()
+        _histograms.clear()
+    return snapshot
+
+def merge(snapshot):
+    """
+    Add the metrics drained from another process to the metrics of this process.
+
+    Args:
+        - snapshot: The value returned by drain(), or None
+
+    Returns:
+        - None
+    """
+    if not ENABLED or snapshot is None:
+        return
+    counters, histograms = snapshot
+    with _lock:
+        for key, value in counters.items():
+            _counters[key] = _counters.get(key, 0) + value
+        for key, values in histograms.items():
+            histogram = _histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                histogram[i] += value
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{_escape(value)}"' for label, value in labels) + '}'
+
+def render_prometheus():
+    """
+    Render the metrics of this process in the Prometheus text exposition format.
+
+    Returns:
+        - The metrics as a string
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(values) for key, values in _histograms.items()}
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {PREFIX}{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}{name} {kind}')
+        if kind == 'histogram':
+            for labels, values in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(f'{PREFIX}{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{PREFIX}{name}_sum{_format_labels(labels)} {values[-2]}')
+                lines.append(f'{PREFIX}{name}_count{_format_labels(labels)} {values[-1]}')
+        else:
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'{PREFIX}{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
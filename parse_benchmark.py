@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import timeit
+import argparse
+import resource
+import multiprocessing
+import analyzer
+import sec_parser as sp
+from sec_parser.processing_steps import TopSectionManagerFor10Q, IndividualSemanticElementExtractor, TopSectionTitleCheck
+
+def peak_rss_mb():
+    """
+    Get the peak resident set size of this process.
+
+    Returns:
+        - float: The peak RSS in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _parse_in_child(filing_html_path, streaming, results):
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    sections = analyzer.parse_filing_sections(filing_html_path, use_cache=False, streaming=streaming)
+    results.put({
+        'seconds': time.perf_counter() - start,
+        'sections': len(sections),
+        'baseline_rss_mb': baseline,
+        'peak_rss_mb': peak_rss_mb()
+    })
+
+def measure_parse(filing_html_path, streaming):
+    """
+    Parse a filing in a fresh process and measure its time and peak memory.
+
+    A fresh process is used for every measurement, since the peak RSS of a process never goes down.
+
+    Args:
+        - filing_html_path (str): The path to the filing document.
+        - streaming (bool): Whether to parse in streaming mode.
+
+    Returns:
+        - dict: The "seconds" spent parsing, the number of "sections", the "baseline_rss_mb" of the
+          process before parsing and its "peak_rss_mb" after parsing.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_parse_in_child, args=(filing_html_path, streaming, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def report_memory(filing_html_paths):
+    """
+    Print the parse time and peak RSS of each filing with the full and the streaming parser.
+
+    Args:
+        - filing_html_paths: The paths to the filing documents.
+
+    Returns:
+        - None
+    """
+    print(f"{'filing':<40} {'MB':>7} {'mode':<10} {'seconds':>8} {'peak RSS MB':>12} {'parse MB':>9}")
+    for path in filing_html_paths:
+        size = os.path.getsize(path) / (1024 * 1024)
+        for mode, streaming in (('full', False), ('streaming', True)):
+            result = measure_parse(path, streaming)
+            print(f"{os.path.basename(os.path.dirname(path)) or path:<40.40} {size:>7.1f} {mode:<10} {result['seconds']:>8.2f} "
+                  f"{result['peak_rss_mb']:>12.1f} {result['peak_rss_mb'] - result['baseline_rss_mb']:>9.1f}")
+
+def _legacy_steps():
+    # The step pipeline as it was built before Edgar10KParser, for comparison
+    all_steps = sp.Edgar10QParser().get_default_steps()
+    steps_without_top_section_manager = [step for step in all_steps if not isinstance(step, TopSectionManagerFor10Q)]
+
+    def get_checks_without_top_section_title_check():
+        all_checks = sp.Edgar10QParser().get_default_single_element_checks()
+        return [check for check in all_checks if not isinstance(check, TopSectionTitleCheck)]
+    return [
+        IndividualSemanticElementExtractor(get_checks=get_checks_without_top_section_title_check)
+        if isinstance(step, IndividualSemanticElementExtractor)
+        else step
+        for step in steps_without_top_section_manager
+    ]
+
+def _legacy_parse(html):
+    parser = sp.Edgar10QParser(get_steps=_legacy_steps)
+    elements = parser.parse(html)
+    return list(sp.TreeBuilder().build(elements).nodes)
+
+def _parse(html):
+    return analyzer.get_10k_parser().parse(html)
+
+def report_setup(filing_html_paths, number=2000):
+    """
+    Print the per-filing setup overhead of the parser before and after Edgar10KParser.
+
+    The setup is everything a parse does besides the work on the document itself: building the
+    parser and its step pipeline, and, before, building the semantic tree that only served to
+    walk the elements in order. When filings are given, the parse time of each is printed too.
+
+    Args:
+        - filing_html_paths: The paths to the filing documents, may be empty.
+        - number (int): The number of repetitions of the setup measurements.
+
+    Returns:
+        - None
+    """
+    before = timeit.timeit(lambda: sp.Edgar10QParser(get_steps=_legacy_steps)._get_steps(), number=number) / number
+    analyzer.get_10k_parser()
+    after = timeit.timeit(lambda: analyzer.get_10k_parser()._get_steps(), number=number) / number
+    print(f"parser and step setup per filing: before {before * 1e6:.1f} us, after {after * 1e6:.1f} us")
+
+    for path in filing_html_paths:
+        with open(path, 'r') as file:
+            html = file.read()
+        elements = _parse(html)
+        tree = timeit.timeit(lambda: sp.TreeBuilder().build(elements), number=10) / 10
+        # Best of several runs, since a single parse is noisy
+        repeat = max(3, min(20, int(1 / max(timeit.timeit(lambda: _parse(html), number=1), 1e-3))))
+        parse_before = min(timeit.repeat(lambda: _legacy_parse(html), number=1, repeat=repeat))
+        parse_after = min(timeit.repeat(lambda: _parse(html), number=1, repeat=repeat))
+        print(f"{path}: {len(elements)} elements, semantic tree {tree * 1e3:.2f} ms, "
+              f"parse before {parse_before * 1e3:.2f} ms, after {parse_after * 1e3:.2f} ms "
+              f"({(1 - parse_after / parse_before) * 100:.1f}% less)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parsing of 10-K filings")
+    parser.add_argument('command', choices=['memory', 'setup'], help="The benchmark to run")
+    parser.add_argument('filings', nargs='*', help="The paths to the filing documents")
+    args = parser.parse_args()
+
+    if args.command == 'memory':
+        report_memory(args.filings)
+    else:
+        report_setup(args.filings)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from contextlib import closing
+import metrics
+
+CACHE_PATH = os.environ.get('PROMPT_CACHE_PATH', os.path.join('cache', 'prompt_results.sqlite'))
+MAX_CACHE_BYTES = int(os.environ.get('PROMPT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    prompt_version INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    result TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+def cache_key(prompt_version, model, context_text, fields):
+    """
+    Build the cache key of an LLM result.
+
+    Args:
+        - prompt_version (int): The version of the prompt template.
+        - model (str): The model the prompt is sent to.
+        - context_text (str): The context selected from the filing.
+        - fields (list): The main fields asked for.
+
+    Returns:
+        - str: A key that changes with the prompt version, the model, the context and the fields,
+          and not with the ticker or year the context came from.
+    """
+    context_sha256 = hashlib.sha256(context_text.encode('utf-8')).hexdigest()
+    key = json.dumps([prompt_version, model, sorted(fields), context_sha256])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def _connect(cache_path):
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    # Every call opens its own connection, so threads and processes can share the database
+    connection = sqlite3.connect(cache_path, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(_SCHEMA)
+    return connection
+
+def _count(connection, name):
+    connection.execute('INSERT INTO counters (name, value) VALUES (?, 1) '
+                       'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+def load_result(key, cache_path=CACHE_PATH):
+    """
+    Load an LLM result from the cache, counting the lookup as a hit or a miss.
+
+    Args:
+        - key (str): The key returned by cache_key().
+        - cache_path (str): The path of the SQLite database.
+
+    Returns:
+        - The cached result, or None if it is not cached.
+    """
+    with closing(_connect(cache_path)) as connection, connection:
+        row = connection.execute('SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            _count(connection, 'misses')
+            metrics.inc('cache_misses_total', cache='prompt_results')
+            return None
+        # The last use drives the eviction of the least recently used results
+        connection.execute('UPDATE results SET last_used = ?, hits = hits + 1 WHERE key = ?', (time.time(), key))
+        _count(connection, 'hits')
+    metrics.inc('cache_hits_total', cache='prompt_results')
+    return json.loads(row[0])
+
+def save_result(key, result, prompt_version, model, cache_path=CACHE_PATH, max_bytes=MAX_CACHE_BYTES):
+    """
+    Save an LLM result in the cache and evict the least recently used results over the size cap.
+
+    Args:
+        - key (str): The key returned by cache_key().
+        - result: The JSON-serializable result.
+        - prompt_version (int): The version of the prompt template, kept for inspection.
+        - model (str): The model, kept for inspection.
+        - cache_path (str): The path of the SQLite database.
+        - max_bytes (int): The size cap of the cached results in bytes.
+
+    Returns:
+        - None
+    """
+    text = json.dumps(result)
+    now = time.time()
+    with closing(_connect(cache_path)) as connection, connection:
+        connection.execute('INSERT OR REPLACE INTO results (key, prompt_version, model, result, bytes, created, last_used) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)', (key, prompt_version, model, text, len(text.encode('utf-8')), now, now))
+        _evict(connection, max_bytes)
+
+def _evict(connection, max_bytes):
+    total_bytes = connection.execute('SELECT COALESCE(SUM(bytes), 0) FROM results').fetchone()[0]
+    removed = 0
+    if total_bytes <= max_bytes:
+        return removed
+    for key, size in connection.execute('SELECT key, bytes FROM results ORDER BY last_used').fetchall():
+        if total_bytes <= max_bytes:
+            break
+        connection.execute('DELETE FROM results WHERE key = ?', (key,))
+        total_bytes -= size
+        removed += 1
+    return removed
+
+def evict(cache_path=CACHE_PATH, max_bytes=MAX_CACHE_BYTES):
+    """
+    Remove the least recently used results until the cache fits in the size cap.
+
+    Args:
+        - cache_path (str): The path of the SQLite database.
+        - max_bytes (int): The size cap of the cached results in bytes.
+
+    Returns:
+        - int: The number of removed results.
+    """
+    with closing(_connect(cache_path)) as connection, connection:
+        return _evict(connection, max_bytes)
+
+def stats(cache_path=CACHE_PATH):
+    """
+    Summarize the contents and the use of the cache.
+
+    Args:
+        - cache_path (str): The path of the SQLite database.
+
+    Returns:
+        - dict: The number of results, their total size, the size cap, and the hits and misses
+          of the lookups since the cache was created.
+    """
+    with closing(_connect(cache_path)) as connection:
+        entries, total_bytes = connection.execute('SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM results').fetchone()
+        counters = dict(connection.execute('SELECT name, value FROM counters').fetchall())
+    hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+    return {
+        "cache_path": cache_path,
+        "entries": entries,
+        "bytes": total_bytes,
+        "max_bytes": MAX_CACHE_BYTES,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": f"{hits / (hits + misses):.1%}" if hits + misses else "n/a"
+    }
+
+def purge(cache_path=CACHE_PATH):
+    """
+    Remove every result from the cache and reset its statistics.
+
+    Args:
+        - cache_path (str): The path of the SQLite database.
+
+    Returns:
+        - int: The number of removed results.
+    """
+    with closing(_connect(cache_path)) as connection, connection:
+        removed = connection.execute('DELETE FROM results').rowcount
+        connection.execute('DELETE FROM counters')
+    return removed
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or purge the cache of LLM results")
+    parser.add_argument('command', choices=['stats', 'purge'], help="The action to perform")
+    parser.add_argument('--cache_path', type=str, default=CACHE_PATH, help="The path of the SQLite database")
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        for name, value in stats(args.cache_path).items():
+            print(f"{name}: {value}")
+    else:
+        print(f"Removed {purge(args.cache_path)} results from {args.cache_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import contextlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+import metrics
+import file_lock
+
+# Bump whenever the look of the plots changes so that every plot is redrawn
+RENDER_VERSION = 1
+
+# Figure size and subplot grid of each layout; figures of the same layout are reused
+LAYOUTS = {
+    'metric': {'figsize': (8, 6), 'ncols': 1},
+    'segments': {'figsize': (16, 6), 'ncols': 2},
+}
+# Above this many tickers, peer plots draw the tickers as unlabelled lines behind the aggregates
+LABELLED_TICKERS = 8
+
+def draw_metric_bar_plot(fig, axes, key, years, values):
+    """
+    Draw the bar plot of one metric over the years.
+
+    Args:
+        - fig: The figure to draw on
+        - axes: The axes of the figure
+        - key: The metric, e.g. "Revenue"
+        - years: The years on the x-axis
+        - values: The value of the metric for each year
+
+    Returns:
+        - None
+    """
+    ax = axes[0]
+    ax.set_yscale('symlog') # Use logarithmic scale for the y-axis
+    ax.bar(range(len(years)), values, color=[('r' if v < 0 else 'b') for v in values])
+    ax.set_xlabel('Year')
+    ax.set_ylabel(key)
+    ax.set_title(f'{key} over the Years')
+    ax.set_xticks(range(len(years)), years)
+
+def draw_segment_bar_plots(fig, axes, year, revenue_data, net_income_data):
+    """
+    Draw the Revenue and Net Income segment bar plots of one year.
+
+    Args:
+        - fig: The figure to draw on
+        - axes: The axes of the figure
+        - year: The year of the segments
+        - revenue_data: A dictionary mapping each revenue segment to its value in billions
+        - net_income_data: A dictionary mapping each net income segment to its value in billions
+
+    Returns:
+        - None
+    """
+    ax1, ax2 = axes
+    fig.suptitle(f'Revenue and Net Income Segments for {year}')
+
+    # Revenue bar plot
+    revenue_labels = list(revenue_data.keys())
+    revenue_values = list(revenue_data.values())
+
+    num_segments = len(revenue_values)
+    revenue_colors = ['#%02x%02x%02x' % (r, g, b) for r, g, b in zip(
+        np.round(np.linspace(0, 102, num_segments)).astype(int),
+        np.round(np.linspace(115, 204, num_segments)).astype(int),
+        np.round(np.linspace(230, 255, num_segments)).astype(int))]
+
+    ax1.bar(revenue_labels, revenue_values, color=revenue_colors)
+    ax1.set_xlabel('Revenue Segment')
+    ax1.set_ylabel('Value (in billions)')
+    ax1.set_title('Revenue Segments')
+    ax1.tick_params(axis='x', rotation=45)
+    ax1.set_yscale('symlog')# Use logarithmic scale for the y-axis
+
+    # Net Income bar plot
+    net_income_labels = list(net_income_data.keys())
+    net_income_values = list(net_income_data.values())
+
+    num_segments = len(net_income_values)
+    profit_colors = ['#%02x%02x%02x' % (r, g, b) for r, g, b in zip(
+        np.round(np.linspace(179, 0, num_segments)).astype(int),
+        np.round(np.linspace(217, 115, num_segments)).astype(int),
+        np.round(np.linspace(255, 230, num_segments)).astype(int))]
+    loss_colors = ['#%02x%02x%02x' % (r, g, b) for r, g, b in zip(
+        np.round(np.linspace(255, 230, num_segments)).astype(int),
+        np.round(np.linspace(179, 0, num_segments)).astype(int),
+        np.round(np.linspace(179, 0, num_segments)).astype(int))]
+
+    net_income_colors = []
+    for value in net_income_values:
+        if value < 0:
+            index = int(abs(value) / abs(min(net_income_values)) * (num_segments - 1))
+            net_income_colors.append(loss_colors[index])
+        else:
+            index = int(value / max(net_income_values) * (num_segments - 1))
+            net_income_colors.append(profit_colors[index])
+
+    ax2.bar(net_income_labels, net_income_values, color=net_income_colors)
+    ax2.set_xlabel('Net Income Segment')
+    ax2.set_ylabel('Value (in billions)')
+    ax2.set_title('Net Income Segments')
+    ax2.tick_params(axis='x', rotation=45)
+    ax2.set_yscale('symlog')# Use logarithmic scale for the y-axis
+
+    fig.tight_layout()
+    fig.subplots_adjust(top=0.88)
+
+def draw_peer_plot(fig, axes, name, unit, years, tickers, values, p25, median, p75):
+    """
+    Draw one series of many tickers over the years against the peer median and interquartile range.
+
+    Args:
+        - fig: The figure to draw on
+        - axes: The axes of the figure
+        - name: The series, e.g. "Effective Tax Rate"
+        - unit: The unit of the series, e.g. "%"
+        - years: The years on the x-axis
+        - tickers: The tickers of the rows of values
+        - values: The value of each ticker for each year, None where it has none
+        - p25, median, p75: The peer percentiles for each year, None where no ticker has a value
+
+    Returns:
+        - None
+    """
+    ax = axes[0]
+    x = np.arange(len(years))
+    values = np.asarray(values, dtype=float).reshape(len(tickers), len(years))
+    if len(tickers) <= LABELLED_TICKERS:
+        for ticker, row in zip(tickers, values):
+            ax.plot(x, row, marker='o', linewidth=1, label=ticker)
+    else:
+        # One collection instead of a line per ticker keeps hundreds of tickers cheap to draw
+        lines = np.stack([np.broadcast_to(x, values.shape), values], axis=-1)
+        ax.add_collection(LineCollection(lines, colors='grey', linewidths=0.5, alpha=0.3))
+        ax.autoscale_view()
+        if not np.isnan(values).all():
+            # A few outliers would flatten the aggregates, so the view spans the bulk of the values
+            low, high = np.nanpercentile(values, [5, 95])
+            pad = (high - low) * 0.1 or 1
+            ax.set_ylim(low - pad, high + pad)
+    ax.fill_between(x, np.asarray(p25, dtype=float), np.asarray(p75, dtype=float), color='b', alpha=0.15,
+                    label='Peer interquartile range')
+    ax.plot(x, np.asarray(median, dtype=float), color='b', linewidth=2.5, label='Peer median')
+    ax.set_xlabel('Year')
+    ax.set_ylabel(f'{name} ({unit})')
+    ax.set_title(f'{name}: {len(tickers)} tickers')
+    ax.set_xticks(x, years)
+    ax.legend(fontsize='small')
+
+# Draw function name -> (layout, draw function)
+DRAW_FUNCTIONS = {
+    'metric_bar': ('metric', draw_metric_bar_plot),
+    'segment_bars': ('segments', draw_segment_bar_plots),
+    'peer_lines': ('metric', draw_peer_plot),
+}
+
+_figures = threading.local()
+
+def _get_figure(layout):
+    """
+    Get the figure of a layout for this thread, creating it on first use and clearing it afterwards.
+
+    Figures are drawn through the object-oriented Agg API, never through pyplot, so they hold
+    no global state and are only shared by the renders of one thread.
+    """
+    pool = _figures.__dict__.setdefault('pool', {})
+    if layout not in pool:
+        fig = Figure(figsize=LAYOUTS[layout]['figsize'])
+        FigureCanvasAgg(fig)
+        axes = list(fig.subplots(1, LAYOUTS[layout]['ncols'], squeeze=False)[0])
+        params = fig.subplotpars
+        pool[layout] = (fig, axes, dict(left=params.left, right=params.right, bottom=params.bottom,
+                                        top=params.top, wspace=params.wspace, hspace=params.hspace))
+        return fig, axes
+
+    # Start from the same layout as a new figure, since tight_layout() depends on it
+    fig, axes, params = pool[layout]
+    for ax in axes:
+        ax.clear()
+    fig.subplots_adjust(**params)
+    return fig, axes
+
+def render_figure(draw_name, inputs, plot_path):
+    """
+    Render one figure to a PNG file.
+
+    The PNG is written to a temporary file of its own and moved into place, so readers never see a
+    partial image and concurrent renders of the same plot do not clash.
+
+    Args:
+        - draw_name: The name of the draw function in DRAW_FUNCTIONS
+        - inputs: The arguments of the draw function after the figure and axes
+        - plot_path: The path of the PNG file
+
+    Returns:
+        - The time taken in seconds
+    """
+    start = time.perf_counter()
+    layout, draw = DRAW_FUNCTIONS[draw_name]
+    fig, axes = _get_figure(layout)
+    draw(fig, axes, *inputs)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(plot_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            fig.savefig(f, format='png')
+        os.replace(tmp_path, plot_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return time.perf_counter() - start
+
+def _manifest_lock(ticker):
+    # Serializes the renders of a directory across threads and processes, from loading its manifest to saving it
+    return file_lock.locked(f'visualizations/{ticker}/.lock')
+
+def load_manifest(ticker):
+    """
+    Load the manifest of the rendered plots of a ticker.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+
+    Returns:
+        - A dictionary mapping each plot path, relative to "visualizations/{ticker}", to the hash of its inputs
+    """
+    manifest_path = f'visualizations/{ticker}/manifest.json'
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(ticker, manifest):
+    """
+    Atomically save the manifest of the rendered plots of a ticker.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+        - manifest: A dictionary mapping each plot path to the hash of its inputs
+
+    Returns:
+        - None
+    """
+    manifest_path = f'visualizations/{ticker}/manifest.json'
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(manifest_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def render_plots(ticker, plots, kinds, workers=1, executor=None, on_rendered=None):
+    """
+    Render the plots whose inputs changed since they were last rendered.
+
+    Plots in the given kinds of directories that are no longer wanted are removed afterwards.
+    Plots of other directories are left alone, so a few plots can be rendered ahead of the rest
+    by passing no kinds. Renders of the same ticker, from any thread or process, take turns on a
+    lock of its directory, so a later one finds the plots of an earlier one up to date.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+        - plots: A dictionary mapping each plot path, relative to "visualizations/{ticker}"
+          (e.g. "insights/Revenue.png"), to a (draw function name, inputs) tuple
+        - kinds: The plot directories owned by this call, e.g. ["insights", "detailed"]
+        - workers: The number of processes used to render, 1 to render in this thread
+        - executor: An existing process pool to render in instead of starting one
+        - on_rendered: A callback taking (plot path, seconds) that is called as soon as each plot
+          is on disk, with None seconds for the plots that were up to date
+
+    Returns:
+        - A dictionary mapping each plot path to the seconds spent rendering it, or None if it was up to date
+    """
+    with _manifest_lock(ticker), contextlib.ExitStack() as stack:
+        for kind in kinds:
+            os.makedirs(f'visualizations/{ticker}/{kind}', exist_ok=True)
+        manifest = load_manifest(ticker)
+        timings = {}
+        pending = {}
+
+        for name, (draw_name, inputs) in plots.items():
+            plot_path = f'visualizations/{ticker}/{name}'
+            digest = hashlib.sha256(json.dumps([RENDER_VERSION, draw_name, inputs]).encode()).hexdigest()
+            if manifest.get(name) == digest and os.path.exists(plot_path):
+                timings[name] = None
+            else:
+                pending[name] = (draw_name, inputs, plot_path, digest)
+
+        if executor is None and workers > 1 and len(pending) > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=min(workers, len(pending))))
+
+        on_rendered = on_rendered or (lambda name, seconds: None)
+        for name in timings:
+            on_rendered(name, None)
+        for plot_path in {pending_plot[2] for pending_plot in pending.values()}:
+            os.makedirs(os.path.dirname(plot_path), exist_ok=True)
+
+        if executor is None:
+            for name, (draw_name, inputs, plot_path, digest) in pending.items():
+                timings[name] = render_figure(draw_name, inputs, plot_path)
+                manifest[name] = digest
+                on_rendered(name, timings[name])
+        else:
+            futures = {executor.submit(render_figure, draw_name, inputs, plot_path): name
+                       for name, (draw_name, inputs, plot_path, digest) in pending.items()}
+            for future in as_completed(futures):
+                name = futures[future]
+                timings[name] = future.result()
+                manifest[name] = pending[name][3]
+                on_rendered(name, timings[name])
+
+        # Only plots are removed, never the temporary files of a render in progress elsewhere
+        for kind in kinds:
+            for file_name in os.listdir(f'visualizations/{ticker}/{kind}'):
+                if file_name.endswith('.png') and f'{kind}/{file_name}' not in plots:
+                    os.remove(f'visualizations/{ticker}/{kind}/{file_name}')
+        manifest = {name: digest for name, digest in manifest.items()
+                    if name in plots or name.split('/')[0] not in kinds}
+        save_manifest(ticker, manifest)
+
+    # Figures may be rendered in other processes, so their times are recorded here
+    for seconds in timings.values():
+        if seconds is None:
+            metrics.inc('cache_hits_total', cache='plots')
+        else:
+            metrics.inc('cache_misses_total', cache='plots')
+            metrics.observe('render', seconds)
+    return {name: timings[name] for name in plots}
@@ -0,0 +1,166 @@
+import os
+import gzip
+import hashlib
+import argparse
+import tempfile
+from importlib.metadata import version, PackageNotFoundError
+
+CACHE_DIR = os.environ.get('PARSED_TEXT_CACHE_DIR', os.path.join('cache', 'parsed_text'))
+MAX_CACHE_BYTES = int(os.environ.get('PARSED_TEXT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Bump whenever the format of the cached text changes
+FORMAT_VERSION = 2
+
+try:
+    SEC_PARSER_VERSION = version('sec-parser')
+except PackageNotFoundError:
+    SEC_PARSER_VERSION = 'unknown'
+
+def cache_key(filing_sha256, variant=''):
+    """
+    Build the cache key of a parsed filing.
+
+    Args:
+        - filing_sha256 (str): The content hash of the filing document.
+        - variant (str): The way the filing was parsed when it differs from the default, e.g. "streaming".
+
+    Returns:
+        - str: A key that changes with the document, the sec-parser version, the cache format and the variant.
+    """
+    key = f"{filing_sha256}:{SEC_PARSER_VERSION}:{FORMAT_VERSION}"
+    if variant:
+        key += f":{variant}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, f'{key}.txt.gz')
+
+def load_text(key, cache_dir=CACHE_DIR):
+    """
+    Load a parsed filing text from the cache.
+
+    Args:
+        - key (str): The key returned by cache_key().
+        - cache_dir (str): The cache directory.
+
+    Returns:
+        - str: The cached text, or None if it is not cached.
+    """
+    path = _entry_path(key, cache_dir)
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            text = file.read()
+        # The modification time tracks the last use for LRU eviction
+        os.utime(path)
+    except (OSError, EOFError):
+        return None
+    return text
+
+def save_text(key, text, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Save a parsed filing text in the cache and evict the least recently used entries over the size cap.
+
+    Args:
+        - key (str): The key returned by cache_key().
+        - text (str): The parsed filing text.
+        - cache_dir (str): The cache directory.
+        - max_bytes (int): The size cap of the cache in bytes.
+
+    Returns:
+        - None
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first so that concurrent workers never read a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as file:
+            file.write(text.encode('utf-8'))
+        os.replace(tmp_path, _entry_path(key, cache_dir))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    evict(cache_dir, max_bytes)
+
+def _entries(cache_dir):
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for file_name in os.listdir(cache_dir):
+        if not file_name.endswith('.txt.gz'):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, file_name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, file_name))
+    return entries
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Remove the least recently used entries until the cache fits in the size cap.
+
+    Args:
+        - cache_dir (str): The cache directory.
+        - max_bytes (int): The size cap of the cache in bytes.
+
+    Returns:
+        - int: The number of removed entries.
+    """
+    entries = sorted(_entries(cache_dir))
+    total_bytes = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, file_name in entries:
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, file_name))
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+        removed += 1
+    return removed
+
+def stats(cache_dir=CACHE_DIR):
+    """
+    Summarize the contents of the cache.
+
+    Args:
+        - cache_dir (str): The cache directory.
+
+    Returns:
+        - dict: The number of entries, their total size and the size cap.
+    """
+    entries = _entries(cache_dir)
+    return {
+        "cache_dir": cache_dir,
+        "entries": len(entries),
+        "bytes": sum(size for _, size, _ in entries),
+        "max_bytes": MAX_CACHE_BYTES,
+        "sec_parser_version": SEC_PARSER_VERSION
+    }
+
+def purge(cache_dir=CACHE_DIR):
+    """
+    Remove every entry from the cache.
+
+    Args:
+        - cache_dir (str): The cache directory.
+
+    Returns:
+        - int: The number of removed entries.
+    """
+    return evict(cache_dir, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or purge the parsed filing text cache")
+    parser.add_argument('command', choices=['stats', 'purge'], help="The action to perform")
+    parser.add_argument('--cache_dir', type=str, default=CACHE_DIR, help="The cache directory")
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        for name, value in stats(args.cache_dir).items():
+            print(f"{name}: {value}")
+    else:
+        print(f"Removed {purge(args.cache_dir)} entries from {args.cache_dir}")
+
+if __name__ == '__main__':
+    main()
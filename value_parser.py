@@ -0,0 +1,82 @@
+import re
+from functools import lru_cache
+from collections import namedtuple
+
+# A parsed value: money is normalized to billions, percentages are kept as they are
+ParsedValue = namedtuple('ParsedValue', ['value', 'unit'])
+
+BILLION = 'billion'
+PERCENT = 'percent'
+
+_SCALES = {
+    'trillion': 1000, 't': 1000,
+    'billion': 1, 'bn': 1, 'b': 1,
+    'million': 1 / 1000, 'mn': 1 / 1000, 'mm': 1 / 1000, 'm': 1 / 1000,
+    'thousand': 1 / 1000000, 'k': 1 / 1000000,
+}
+
+# One pass over the string: an optional sign or opening parenthesis, before or after the
+# currency symbol, the number with its thousands separators, then an optional unit. A sign
+# in front must not follow a word, as in "FY-2022". Single letter units are only recognized
+# in upper case, e.g. "$5.2M" but not "5 m".
+_VALUE_PATTERN = re.compile(r'''
+    (?:(?<![\w.])(?P<sign>[-+−(])\s*)?
+    (?:\$\s*(?P<inner_sign>[-+−(])?\s*)?
+    (?P<number>\d[\d,]*(?:\.\d*)?|\.\d+)\)?\s*
+    (?P<unit>%|(?i:percent|trillion|billion|million|thousand|bn|mn|mm)\b|[TBMK]\b)?
+''', re.VERBOSE)
+
+@lru_cache(maxsize=65536)
+def parse_value(text):
+    """
+    Parse a money or percentage string from an analysis into a typed value.
+
+    Args:
+        - text (str): The string to parse, e.g. "$118.06 billion", "-$9.17 billion", "$339 million" or "16%".
+
+    Returns:
+        - ParsedValue: The value in billions with the unit "billion" (plain numbers are taken to be
+          in billions), or the value with the unit "percent"; None if the string has no number.
+    """
+    match = _VALUE_PATTERN.search(text)
+    if not match:
+        return None
+
+    value = float(match.group('number').replace(',', ''))
+    if match.group('sign') in ('-', '−', '(') or match.group('inner_sign') in ('-', '−', '('):
+        value = -value
+
+    unit = match.group('unit')
+    if unit is None:
+        return ParsedValue(value, BILLION)
+    unit = unit.lower()
+    if unit in ('%', 'percent'):
+        return ParsedValue(value, PERCENT)
+    return ParsedValue(value * _SCALES[unit], BILLION)
+
+def parse_analysis(json_data):
+    """
+    Parse every value of an analysis.
+
+    Args:
+        - json_data (dict): The analysis, mapping each main field to a string or to a dictionary of
+          segment strings.
+
+    Returns:
+        - dict: The same structure with every parseable string replaced by a ParsedValue. Strings
+          without a number and values that are not strings are left out.
+    """
+    parsed = {}
+    for key, value in json_data.items():
+        if isinstance(value, dict):
+            parsed[key] = {}
+            for sub_key, sub_value in value.items():
+                if isinstance(sub_value, str):
+                    parsed_value = parse_value(sub_value)
+                    if parsed_value is not None:
+                        parsed[key][sub_key] = parsed_value
+        elif isinstance(value, str):
+            parsed_value = parse_value(value)
+            if parsed_value is not None:
+                parsed[key] = parsed_value
+    return parsed
@@ -1,35 +1,19 @@
-from analyzer import analyze, parse_filing_text
+from analyzer import analyze, analysis_cache_key, filing_context, MAIN_FIELDS, LEGACY_PROMPT_VERSION, LEGACY_MODEL
+from xbrl_extractor import extract_analysis
+from fetch_10k import get_year
+from value_parser import parse_analysis
+from insights_store import InsightsStore
+import render
+import metrics
 import os
-import re
+import logging
+import threading
 import argparse
 import json
-import matplotlib.pyplot as plt
-import shutil
-import numpy as np
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-
-def get_year(folder_name):
-    """
-    Extract the year from the folder name.
-
-    Args:
-        - folder_name: The name of the folder containing the filing
-
-    Returns:
-        - The year as a string
-    """
-    # Use regular expression to extract the year part from the folder name
-    match = re.search(r'-(\d{2})-', folder_name)
-    if match:
-        year = int(match.group(1))
-        if year > 80:
-            year += 1900
-        else:
-            year += 2000
-    else:
-        return None
-
-    return str(year)
+logger = logging.getLogger(__name__)
 
 def extract_total_values(json_data):
     """
@@ -66,54 +50,13 @@ def extract_total_values(json_data):
         }
 
     """
-    main_keys = list(json_data.keys())
     total_values = {}
+    for key, value in parse_analysis(json_data).items():
+        if isinstance(value, dict):
+            total_values[key] = sum(sub_value.value for sub_value in value.values())
+        else:
+            total_values[key] = value.value
 
-    for key in main_keys:
-        if isinstance(json_data[key], dict):
-            total_value = 0
-            for sub_key, sub_value in json_data[key].items():
-                if isinstance(sub_value, str):
-                    # Extract the sign (+ or -) from the string
-                    sign = 1
-                    if sub_value.startswith('-'):
-                        sign = -1
-                        sub_value = sub_value[1:]
-                    elif sub_value.startswith('+'):
-                        sub_value = sub_value[1:]
-
-                    # Replace anything non-number (except the decimal point) in the string with an empty string
-                    value_str = re.sub(r'[^0-9.]', '', sub_value)
-                    if value_str:
-                        value = float(value_str)
-                        # Convert value to billion if it contains "million" or "thousand"
-                        if "million" in sub_value or "M" in sub_value:
-                            value /= 1000
-                        elif "thousand" in sub_value:
-                            value /= 1000000
-                        total_value += sign * value
-            total_values[key] = total_value
-        elif isinstance(json_data[key], str):
-            # Extract the sign (+ or -) from the string
-            sign = 1
-            if json_data[key].startswith('-'):
-                sign = -1
-                json_data[key] = json_data[key][1:]
-            elif json_data[key].startswith('+'):
-                json_data[key] = json_data[key][1:]
-
-            # Replace anything non-number (except the decimal point) in the string with an empty string
-            value_str = re.sub(r'[^0-9.]', '', json_data[key])
-            if value_str:
-                value = float(value_str)
-                # Convert value to billion if it contains "million" or "thousand"
-                if "million" in json_data[key] or "M" in json_data[key]:
-                    value /= 1000
-                elif "thousand" in json_data[key]:
-                    value /= 1000000
-                total_values[key] = sign * value
-
-    print(total_values)
     return total_values
 
 def drop_none_values(data):
@@ -129,41 +72,44 @@ def drop_none_values(data):
     cleaned_data = {k: v for k, v in data.items() if v is not None}
     return cleaned_data
 
-def create_bar_plot(ticker, insights):
+def bar_plots(insights):
     """
-    Create bar plots for the total values of Revenue, Net Income, and other insights over the years.
+    Describe the bar plots for the total values of Revenue, Net Income, and other insights over the years.
 
     Args:
-        - ticker: The company's stock ticker symbol
         - insights: A dictionary containing the insights for each year
 
     Returns:
-        - None
-        - Saves the bar plots in the "visualizations/{ticker}/insights" directory
+        - A dictionary mapping each plot path under "visualizations/{ticker}" to its (draw function name, inputs)
     """
-    # Delete the existing insights directory if it exists
-    if os.path.exists(f'visualizations/{ticker}/insights'):
-        shutil.rmtree(f'visualizations/{ticker}/insights')
     insights = drop_none_values(insights)
     years = sorted(list(insights.keys()))
     total_values_list = [extract_total_values(insights[year]) for year in years]
-    keys = list(total_values_list[0].keys())
+    # A metric missing from some years, the first one included, still gets its plot
+    keys = list(dict.fromkeys(key for total_values in total_values_list for key in total_values))
 
+    plots = {}
     for key in keys:
         values = [total_values[key] if key in total_values else 0 for total_values in total_values_list]
+        plots[f'insights/{key}.png'] = ('metric_bar', (key, years, values))
+    return plots
 
-        plt.figure(figsize=(8, 6))
-        plt.yscale('symlog') # Use logarithmic scale for the y-axis
-        plt.bar(range(len(years)), values, color=[('r' if v < 0 else 'b') for v in values])
-        plt.xlabel('Year')
-        plt.ylabel(key)
-        plt.title(f'{key} over the Years')
-        plt.xticks(range(len(years)), years)
+def create_bar_plot(ticker, insights, workers=1):
+    """
+    Create bar plots for the total values of Revenue, Net Income, and other insights over the years.
 
-        # Save the plot in the visualizations/{ticker} directory
-        os.makedirs(f'visualizations/{ticker}/insights', exist_ok=True)
-        plt.savefig(f'visualizations/{ticker}/insights/{key}.png')
-        plt.close()
+    Only the plots whose values changed since the last run are redrawn.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+        - insights: A dictionary containing the insights for each year
+        - workers: The number of processes used to render the plots
+
+    Returns:
+        - None
+        - Saves the bar plots in the "visualizations/{ticker}/insights" directory
+    """
+    render.render_plots(ticker, bar_plots(insights), ['insights'], workers)
 
 def extract_values_for_segments_charts(json_data):
     """
@@ -199,139 +145,342 @@ def extract_values_for_segments_charts(json_data):
                 ...
         }
     """
-    values = {}
+    return {key: {sub_key: sub_value.value for sub_key, sub_value in value.items()}
+            for key, value in parse_analysis(json_data).items() if isinstance(value, dict)}
 
-    for key, value in json_data.items():
-        if isinstance(value, dict):
-            sub_values = {}
-            for sub_key, sub_value in value.items():
-                if isinstance(sub_value, str):
-                    # Extract the sign (+ or -) from the string
-                    sign = 1
-                    if sub_value.startswith('-'):
-                        sign = -1
-                        sub_value = sub_value[1:]
-                    elif sub_value.startswith('+'):
-                        sub_value = sub_value[1:]
-
-                    # Replace anything non-number (except the decimal point) in the string with an empty string
-                    value_str = re.sub(r'[^0-9.]', '', sub_value)
-                    if value_str:
-                        sub_values[sub_key] = sign * float(value_str)
-            values[key] = sub_values
-
-    return values
-
-def create_segment_bar_plots(ticker, insights):
+def segment_bar_plots(insights):
+    """
+    Describe the bar plots for Revenue and Net Income segments for each year.
+
+    Args:
+        - insights: A dictionary containing the insights for each year
+
+    Returns:
+        - A dictionary mapping each plot path under "visualizations/{ticker}" to its (draw function name, inputs)
+    """
+    plots = {}
+    for year, data in drop_none_values(insights).items():
+        segment_values = extract_values_for_segments_charts(data)
+        plots[f'detailed/{year}_segments.png'] = ('segment_bars', (year, segment_values.get('Revenue', {}),
+                                                                   segment_values.get('Net Income', {})))
+    return plots
+
+def create_segment_bar_plots(ticker, insights, workers=1):
     """
     Create bar plots for Revenue and Net Income segments for each year.
 
+    Only the plots of the years whose segments changed since the last run are redrawn.
+
     Args:
         - ticker: The company's stock ticker symbol
         - insights: A dictionary containing the insights for each year
+        - workers: The number of processes used to render the plots
 
     Returns:
     - None
     - Saves the bar plots in the "visualizations/{ticker}/detailed" directory
     """
-    # Delete the existing detailed directory if it exists
-    if os.path.exists(f'visualizations/{ticker}/detailed'):
-        shutil.rmtree(f'visualizations/{ticker}/detailed')
-
-    for year, data in insights.items():
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 6))
-        fig.suptitle(f'Revenue and Net Income Segments for {year}')
-
-        # Revenue bar plot
-        revenue_data = extract_values_for_segments_charts(data).get('Revenue', {})
-        revenue_labels = list(revenue_data.keys())
-        revenue_values = list(revenue_data.values())
-
-        num_segments = len(revenue_values)
-        revenue_colors = ['#%02x%02x%02x' % (r, g, b) for r, g, b in zip(
-            np.round(np.linspace(0, 102, num_segments)).astype(int),
-            np.round(np.linspace(115, 204, num_segments)).astype(int),
-            np.round(np.linspace(230, 255, num_segments)).astype(int))]
-
-        ax1.bar(revenue_labels, revenue_values, color=revenue_colors)
-        ax1.set_xlabel('Revenue Segment')
-        ax1.set_ylabel('Value (in billions)')
-        ax1.set_title('Revenue Segments')
-        ax1.tick_params(axis='x', rotation=45)
-        ax1.set_yscale('symlog')# Use logarithmic scale for the y-axis
-
-        # Net Income bar plot
-        net_income_data = extract_values_for_segments_charts(data).get('Net Income', {})
-        net_income_labels = list(net_income_data.keys())
-        net_income_values = list(net_income_data.values())
-
-        num_segments = len(net_income_values)
-        profit_colors = ['#%02x%02x%02x' % (r, g, b) for r, g, b in zip(
-            np.round(np.linspace(179, 0, num_segments)).astype(int),
-            np.round(np.linspace(217, 115, num_segments)).astype(int),
-            np.round(np.linspace(255, 230, num_segments)).astype(int))]
-        loss_colors = ['#%02x%02x%02x' % (r, g, b) for r, g, b in zip(
-            np.round(np.linspace(255, 230, num_segments)).astype(int),
-            np.round(np.linspace(179, 0, num_segments)).astype(int),
-            np.round(np.linspace(179, 0, num_segments)).astype(int))]
-
-        net_income_colors = []
-        for value in net_income_values:
-            if value < 0:
-                index = int(abs(value) / abs(min(net_income_values)) * (num_segments - 1))
-                net_income_colors.append(loss_colors[index])
-            else:
-                index = int(value / max(net_income_values) * (num_segments - 1))
-                net_income_colors.append(profit_colors[index])
-
-        ax2.bar(net_income_labels, net_income_values, color=net_income_colors)
-        ax2.set_xlabel('Net Income Segment')
-        ax2.set_ylabel('Value (in billions)')
-        ax2.set_title('Net Income Segments')
-        ax2.tick_params(axis='x', rotation=45)
-        ax2.set_yscale('symlog')# Use logarithmic scale for the y-axis
-
-        plt.tight_layout()
-        plt.subplots_adjust(top=0.88)
-
-        # Save the plot in the visualizations/{ticker}/detailed directory
-        os.makedirs(f'visualizations/{ticker}/detailed', exist_ok=True)
-        plt.savefig(f'visualizations/{ticker}/detailed/{year}_segments.png')
-        plt.close(fig)
+    render.render_plots(ticker, segment_bar_plots(insights), ['detailed'], workers)
 
-def visualize(args):
-    ticker = args.ticker
-    start_year, end_year = int(args.start_year), int(args.end_year)
+def render_all(ticker, insights, workers=os.cpu_count(), executor=None, on_rendered=None):
+    """
+    Render every plot of a ticker in one batch, in parallel across processes.
+
+    The time spent on each plot is logged at debug level, since this runs on every request of the app.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+        - insights: A dictionary containing the insights for each year
+        - workers: The number of processes used to render the plots
+        - executor: An existing process pool to render in, e.g. one shared by several tickers
+        - on_rendered: See render.render_plots()
+
+    Returns:
+        - A dictionary mapping each plot path to the seconds spent rendering it, or None if it was up to date
+    """
+    plots = {**bar_plots(insights), **segment_bar_plots(insights)}
+    timings = render.render_plots(ticker, plots, ['insights', 'detailed'], workers, executor, on_rendered)
+    for name, seconds in timings.items():
+        logger.debug("%s: %s", name, 'up to date' if seconds is None else f'{seconds:.3f}s')
+    return timings
+
+def collect_filings(ticker, start_year, end_year):
+    """
+    Collect the 10-K filings of a ticker that fall in the given year range.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+        - start_year: The first filing year to include
+        - end_year: The last filing year to include
+
+    Returns:
+        - A list of (filing_year, filing_path) tuples sorted by filing year
+    """
     data_path = f'data/sec-edgar-filings/{ticker}/10-K'
-    insights = {}
+    filings = []
     for year in os.listdir(data_path):
         filing_path = os.path.join(data_path, year, 'primary-document.html')
         filing_year = get_year(year)
         if not(int(filing_year) <= end_year and int(filing_year) >= start_year):
             continue
-        filing_text = parse_filing_text(filing_path)
-        # Check if analysis already exists
-        if os.path.exists(f'insights/{ticker}/{filing_year}/analysis.json'):
-            with open(f'insights/{ticker}/{filing_year}/analysis.json', 'r') as f:
-                insights[filing_year] = json.load(f)
-                if insights[filing_year] == None:
-                    print(f"Error in {filing_year} analysis. Re-analyzing...")
-                    insights[filing_year] = analyze(filing_text)  
+        filings.append((filing_year, filing_path))
+
+    return sorted(filings)
+
+def load_analysis(ticker, filing_year, cache_key):
+    """
+    Load the saved analysis of a filing if it is still valid.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+        - filing_year: The filing year
+        - cache_key: The key returned by analysis_cache_key() for the filing
+
+    Returns:
+        - A (analysis, missing_fields) tuple: the saved analysis, or None if it is missing, empty
+          or was made from a different filing, prompt or model, and the main fields it still
+          lacks, which are to be asked for again
+    """
+    analysis_path = f'insights/{ticker}/{filing_year}/analysis.json'
+    meta_path = f'insights/{ticker}/{filing_year}/analysis.meta.json'
+    if not os.path.exists(analysis_path):
+        metrics.inc('cache_misses_total', cache='analysis')
+        return None, []
+    with open(analysis_path, 'r') as f:
+        analysis = json.load(f)
+    if analysis == None:
+        print(f"Error in {filing_year} analysis. Re-analyzing...")
+        metrics.inc('cache_misses_total', cache='analysis')
+        return None, []
+
+    if not os.path.exists(meta_path):
+        # Analyses saved before the key was recorded were made by the first prompt and model; they
+        # are stamped with them, so they are refreshed once the prompt or model has changed
+        meta = {**cache_key, 'prompt_version': LEGACY_PROMPT_VERSION, 'model': LEGACY_MODEL,
+                'missing_fields': [field for field in MAIN_FIELDS if field not in analysis]}
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f, indent=4)
+    else:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    missing_fields = meta.pop('missing_fields', [])
+    if meta != cache_key:
+        print(f"Stale {filing_year} analysis. Re-analyzing...")
+        metrics.inc('cache_misses_total', cache='analysis')
+        return None, []
+
+    metrics.inc('cache_misses_total' if missing_fields else 'cache_hits_total', cache='analysis')
+    return analysis, missing_fields
+
+def save_analysis(ticker, filing_year, analysis, cache_key, missing_fields=None):
+    """
+    Save the analysis of a filing together with the key it was made for.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+        - filing_year: The filing year
+        - analysis: The analysis to save
+        - cache_key: The key returned by analysis_cache_key() for the filing
+        - missing_fields: The main fields the analysis still lacks, asked for again on the next run
+
+    Returns:
+        - None
+        - Saves the analysis in "insights/{ticker}/{filing_year}/analysis.json"
+    """
+    insights_dir = f'insights/{ticker}/{filing_year}'
+    os.makedirs(insights_dir, exist_ok=True)
+    with open(os.path.join(insights_dir, 'analysis.json'), 'w') as f:
+        json.dump(analysis, f, indent=4)
+    with open(os.path.join(insights_dir, 'analysis.meta.json'), 'w') as f:
+        json.dump({**cache_key, 'missing_fields': missing_fields or []}, f, indent=4)
+
+def prepare_filing(filing_path):
+    """
+    Extract the main fields tagged as inline XBRL in a filing and select the context for the others.
+
+    Args:
+        - filing_path: The path to the filing document
+
+    Returns:
+        - A (extracted, missing_fields, filing_text) tuple: the fields read from the XBRL facts, the
+          main fields left for the LLM, and the context selected by filing_context(), which is None
+          when every main field was extracted
+    """
+    try:
+        extracted = extract_analysis(filing_path)
+    except Exception as e:
+        print(f"Error extracting XBRL facts from {filing_path}: {e}")
+        extracted = {}
+    missing_fields = [field for field in MAIN_FIELDS if field not in extracted]
+    return extracted, missing_fields, filing_context(filing_path) if missing_fields else None
+
+def _prepare_in_worker(filing_path):
+    # The metrics recorded in a worker process are handed back to the parent with the result
+    return prepare_filing(filing_path), metrics.drain()
+
+def analyze_filing(ticker, filing_year, filing_text, cache_key, extracted=None, missing_fields=None, previous=None):
+    """
+    Analyze a parsed filing and save the result, with the main fields it still lacks.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+        - filing_year: The filing year
+        - filing_text: The context selected from the filing by filing_context(), or None if the
+          LLM is not needed
+        - cache_key: The key returned by analysis_cache_key() for the filing
+        - extracted: The fields extracted from the XBRL facts of the filing, which take precedence
+          over the LLM
+        - missing_fields: The main fields the LLM is asked for, or None for all of them
+        - previous: A saved analysis of the filing that lacks some main fields; its fields are
+          kept and only the missing ones are asked for
+
+    Returns:
+        - The analysis for the filing year
+    """
+    extracted = extracted or {}
+    previous = previous or {}
+    missing_fields = [field for field in (missing_fields or MAIN_FIELDS) if field not in previous]
+    if filing_text is None or not missing_fields:
+        print(f"Extracted {filing_year} from XBRL facts")
+        analysis = {**previous, **extracted}
+    else:
+        print(f"Analyzing {filing_year}..." if not previous else f"Asking again for {missing_fields} of {filing_year}...")
+        analysis = analyze(filing_text, fields=missing_fields,
+                           completions_path=f'insights/{ticker}/{filing_year}/completions.jsonl')
+        if analysis is not None or previous:
+            analysis = {**previous, **(analysis or {}), **extracted}
+    logger.debug("Analysis of %s: %s", filing_year, analysis)
+    still_missing = [field for field in MAIN_FIELDS if field not in analysis] if analysis is not None else []
+    save_analysis(ticker, filing_year, analysis, cache_key, still_missing)
+    return analysis
+
+def no_progress(stage, status, year=None):
+    """Default progress callback of the pipeline, which ignores every update."""
+
+def analyze_filings(ticker, filings, parse_workers=1, analyze_workers=1, progress=no_progress,
+                    parse_pool=None, analyze_pool=None, on_analysis=None):
+    """
+    Parse and analyze the given filings, in parallel when more than one worker is requested.
+
+    Filings with a complete saved analysis are not parsed at all; those whose saved analysis
+    lacks some main fields are parsed again and only these fields are asked for. The main fields
+    tagged as inline XBRL in the others are extracted directly, and only the fields left over are
+    asked of the LLM.
+    Filings are parsed in a process pool, since parsing is CPU-bound, and the LLM calls wait on
+    the network and run in a thread pool, each one starting as soon as its filing has been parsed.
+
+    Args:
+        - ticker: The company's stock ticker symbol
+        - filings: A list of (filing_year, filing_path) tuples
+        - parse_workers: The number of processes used to parse the filings
+        - analyze_workers: The number of concurrent LLM calls
+        - progress: A callback taking (stage, status, year) that is told when each filing is
+          parsed ("parse") and analyzed ("analyze")
+        - parse_pool: An existing process pool to parse in instead of starting one
+        - analyze_pool: An existing thread pool to call the LLM from instead of starting one
+        - on_analysis: A callback taking (filing_year, analysis) that is called as soon as each
+          analysis is available, saved or new, from the thread that made it
+
+    Returns:
+        - A dictionary containing the analysis for each filing year, in year order
+    """
+    on_analysis = on_analysis or (lambda filing_year, analysis: None)
+
+    def analyze_and_report(filing_year, prepared, cache_key, previous):
+        progress('parse', 'done', filing_year)
+        extracted, missing_fields, filing_text = prepared
+        analysis = analyze_filing(ticker, filing_year, filing_text, cache_key, extracted, missing_fields, previous)
+        progress('analyze', 'failed' if analysis is None else 'done', filing_year)
+        on_analysis(filing_year, analysis)
+        return analysis
+
+    insights = {}
+    pending = []
+    for filing_year, filing_path in filings:
+        cache_key = analysis_cache_key(filing_path)
+        analysis, missing_fields = load_analysis(ticker, filing_year, cache_key)
+        if analysis is None or missing_fields:
+            pending.append((filing_year, filing_path, cache_key, analysis))
+            progress('parse', 'queued', filing_year)
+            progress('analyze', 'queued', filing_year)
         else:
-            print(f"Analyzing {filing_year}...")
-            insights[filing_year] = analyze(filing_text)
-            print(insights[filing_year])
+            insights[filing_year] = analysis
+            progress('parse', 'skipped', filing_year)
+            progress('analyze', 'cached', filing_year)
+            on_analysis(filing_year, analysis)
+
+    if parse_pool is None and analyze_pool is None and parse_workers <= 1 and analyze_workers <= 1:
+        for filing_year, filing_path, cache_key, previous in pending:
+            insights[filing_year] = analyze_and_report(filing_year, prepare_filing(filing_path), cache_key, previous)
+    elif pending:
+        with contextlib.ExitStack() as stack:
+            if parse_pool is None:
+                parse_pool = stack.enter_context(ProcessPoolExecutor(max_workers=max(parse_workers, 1)))
+            if analyze_pool is None:
+                analyze_pool = stack.enter_context(ThreadPoolExecutor(max_workers=max(analyze_workers, 1)))
+            parse_futures = {parse_pool.submit(_prepare_in_worker, filing_path): (filing_year, cache_key, previous)
+                             for filing_year, filing_path, cache_key, previous in pending}
+            analyze_futures = {}
+            for future in as_completed(parse_futures):
+                filing_year, cache_key, previous = parse_futures[future]
+                prepared, worker_metrics = future.result()
+                metrics.merge(worker_metrics)
+                analyze_futures[filing_year] = analyze_pool.submit(
+                    analyze_and_report, filing_year, prepared, cache_key, previous)
+            for filing_year, future in analyze_futures.items():
+                insights[filing_year] = future.result()
+
+    return {filing_year: insights[filing_year] for filing_year, _ in filings}
+
+def generate_insights(ticker, start_year, end_year, parse_workers=1, analyze_workers=1, render_workers=1,
+                      progress=no_progress, parse_pool=None, analyze_pool=None, render_pool=None, on_plot=None):
+    """
+    Analyze the downloaded 10-K filings of a ticker and render their plots.
 
-        # Save the analysis in insights/{ticker}/year/analysis.json
-        insights_dir = f'insights/{ticker}/{filing_year}'
-        print(insights_dir)
-        os.makedirs(insights_dir, exist_ok=True)
-        with open(os.path.join(insights_dir, 'analysis.json'), 'w') as f:
-            json.dump(insights[filing_year], f, indent=4)
+    Args:
+        - ticker: The company's stock ticker symbol
+        - start_year: The first filing year to include
+        - end_year: The last filing year to include
+        - parse_workers: The number of processes used to parse the filings
+        - analyze_workers: The number of concurrent LLM calls
+        - render_workers: The number of processes used to render the plots
+        - progress: A callback taking (stage, status, year) that is told about the progress of
+          the "parse", "analyze" and "render" stages
+        - parse_pool, analyze_pool, render_pool: Existing pools to work in instead of starting
+          new ones, e.g. pools shared by several tickers
+        - on_plot: A callback taking (plot path, seconds) that is called as soon as each plot is
+          on disk, see render.render_plots(). When given, the segment plots of each year are
+          rendered as soon as its analysis is available instead of after the last year.
+
+    Returns:
+        - A dictionary containing the analysis for each filing year, in year order
+    """
+    # Renders of the same ticker update the same manifest, so they take turns
+    manifest_lock = threading.Lock()
+
+    def render_year(filing_year, analysis):
+        with manifest_lock:
+            render.render_plots(ticker, segment_bar_plots({filing_year: analysis}), [],
+                                executor=render_pool, on_rendered=on_plot)
+
+    # The whole run is timed as one stage, the latency the insights are delivered with
+    with metrics.span('generate_insights'):
+        filings = collect_filings(ticker, start_year, end_year)
+        insights = analyze_filings(ticker, filings, parse_workers, analyze_workers, progress, parse_pool,
+                                   analyze_pool, render_year if on_plot is not None else None)
+        progress('parse', 'done')
+        progress('analyze', 'done')
+        InsightsStore().append(ticker, insights)
+
+        # Generate visualizations based on the insights; the segment plots rendered early are up to date
+        progress('render', 'running')
+        render_all(ticker, insights, render_workers, render_pool, on_plot)
+        progress('render', 'done')
+    return insights
 
-    # Generate visualizations based on the insights
-    create_bar_plot(ticker, insights)
-    create_segment_bar_plots(ticker, insights)
+def visualize(args):
+    generate_insights(args.ticker, int(args.start_year), int(args.end_year),
+                      args.parse_workers, args.analyze_workers, args.render_workers)
 
 
 def main():
@@ -339,7 +488,12 @@ def main():
     parser.add_argument('--ticker', type=str, help="The company's stock ticker symbol")
     parser.add_argument('--start_year', type=int, help="The start year for analysis")
     parser.add_argument('--end_year', type=int, help="The end year for analysis")
+    parser.add_argument('--parse_workers', type=int, default=1, help="The number of processes used to parse filings")
+    parser.add_argument('--analyze_workers', type=int, default=1, help="The number of concurrent LLM calls")
+    parser.add_argument('--render_workers', type=int, default=1, help="The number of processes used to render plots")
+    parser.add_argument('--verbose', action='store_true', help="Log completions, analyses and render timings")
     args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
 
     visualize(args)
 
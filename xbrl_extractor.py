@@ -0,0 +1,232 @@
+import re
+import json
+import argparse
+from datetime import date
+from lxml import etree
+
+# The us-gaap concepts that report each main field of the analysis, in order of preference
+REVENUE_CONCEPTS = [
+    'us-gaap:Revenues',
+    'us-gaap:RevenueFromContractWithCustomerExcludingAssessedTax',
+    'us-gaap:RevenueFromContractWithCustomerIncludingAssessedTax',
+    'us-gaap:SalesRevenueNet',
+]
+NET_INCOME_CONCEPTS = ['us-gaap:NetIncomeLoss', 'us-gaap:ProfitLoss']
+TAX_RATE_CONCEPTS = ['us-gaap:EffectiveIncomeTaxRateContinuingOperations']
+DEFERRED_TAX_ASSETS_CONCEPTS = ['us-gaap:DeferredTaxAssetsNet', 'us-gaap:DeferredIncomeTaxAssetsNet']
+DEFERRED_TAX_LIABILITIES_CONCEPTS = ['us-gaap:DeferredTaxLiabilities', 'us-gaap:DeferredIncomeTaxLiabilitiesNet']
+FOREIGN_INCOME_CONCEPT = 'us-gaap:IncomeLossFromContinuingOperationsBeforeIncomeTaxesForeign'
+DOMESTIC_INCOME_CONCEPT = 'us-gaap:IncomeLossFromContinuingOperationsBeforeIncomeTaxesDomestic'
+PRETAX_INCOME_CONCEPT = 'us-gaap:IncomeLossFromContinuingOperationsBeforeIncomeTaxesExtraordinaryItemsNoncontrollingInterest'
+# The axes whose members are used as segments, in order of preference
+SEGMENT_AXES = ['us-gaap:StatementBusinessSegmentsAxis', 'srt:ProductOrServiceAxis']
+# The dei facts whose context is the fiscal year of the report
+PERIOD_CONCEPTS = ['dei:DocumentPeriodEndDate', 'dei:DocumentFiscalYearFocus', 'dei:DocumentType']
+# Segments are only used when they add up to the total within this fraction
+SEGMENT_SUM_TOLERANCE = 0.01
+
+_FACT_TAGS = ('ix:nonfraction', 'ix:nonnumeric')
+
+def _numeric_value(element):
+    """Read the value of an ix:nonFraction fact, applying its format, scale and sign."""
+    if element.get('xsi:nil') == 'true':
+        return None
+    text = ''.join(element.itertext()).strip()
+    number_format = element.get('format', '')
+    if 'zero' in number_format or text in ('-', '—', '–'):
+        number = 0.0
+    else:
+        if 'comma-decimal' in number_format or 'numcommadecimal' in number_format:
+            text = text.replace('.', '').replace(' ', '').replace(',', '.')
+        else:
+            text = text.replace(',', '').replace(' ', '')
+        try:
+            number = float(text)
+        except ValueError:
+            return None
+    number *= 10 ** int(element.get('scale', 0))
+    return -number if element.get('sign') == '-' else number
+
+def _read_context(element):
+    dims = tuple(sorted((member.get('dimension'), (member.text or '').strip())
+                        for member in element.iter('xbrldi:explicitmember')))
+    period = {}
+    for tag in ('startdate', 'enddate', 'instant'):
+        found = element.find(f'.//xbrli:{tag}')
+        if found is not None and found.text:
+            try:
+                period[tag] = date.fromisoformat(found.text.strip()[:10])
+            except ValueError:
+                pass
+    return {'dims': dims, 'start': period.get('startdate'), 'end': period.get('enddate'),
+            'instant': period.get('instant')}
+
+def read_facts(filing_html_path):
+    """
+    Read the inline XBRL facts, contexts and units of a filing document.
+
+    The document is parsed incrementally and every top-level element of the body is dropped
+    once it has been read, so memory stays bounded for large filings.
+
+    Args:
+        - filing_html_path (str): The path to the filing document.
+
+    Returns:
+        - tuple: (facts, contexts, units). facts maps each concept, e.g. "us-gaap:Revenues", to a
+          list of (context id, unit id, value) tuples, the value being a float for numeric facts
+          and a string otherwise; contexts maps each context id to its "dims", "start", "end"
+          and "instant"; units maps each unit id to its measure, e.g. "iso4217:USD".
+    """
+    facts, contexts, units = {}, {}, {}
+    for _, element in etree.iterparse(filing_html_path, events=('end',), html=True):
+        if element.tag == 'xbrli:context':
+            contexts[element.get('id')] = _read_context(element)
+        elif element.tag == 'xbrli:unit':
+            measure = element.find('.//xbrli:measure')
+            units[element.get('id')] = (measure.text or '').strip() if measure is not None else ''
+        elif element.tag in _FACT_TAGS:
+            value = _numeric_value(element) if element.tag == 'ix:nonfraction' else ''.join(element.itertext()).strip()
+            if value is not None:
+                facts.setdefault(element.get('name'), []).append((element.get('contextref'), element.get('unitref'), value))
+        parent = element.getparent()
+        if parent is not None and parent.tag == 'body':
+            # Every fact and context inside the element has been read by the time it ends
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+    return facts, contexts, units
+
+def fiscal_period_end(facts, contexts):
+    """
+    Find the end of the fiscal year that a filing reports on.
+
+    Args:
+        - facts, contexts: As returned by read_facts().
+
+    Returns:
+        - date: The last day of the fiscal year, or None if the filing has no dei facts.
+    """
+    for concept in PERIOD_CONCEPTS:
+        for context_id, _, _ in facts.get(concept, []):
+            context = contexts.get(context_id)
+            if context and context['end']:
+                return context['end']
+    return None
+
+def _in_period(context, period_end, instant):
+    if instant:
+        return context['instant'] == period_end
+    return (context['end'] == period_end and context['start'] is not None
+            and 330 <= (context['end'] - context['start']).days <= 380)
+
+def _values(facts, contexts, units, concept, period_end, instant=False, money=True):
+    """Map the dimensions of each context of a concept in the fiscal period to its value."""
+    values = {}
+    for context_id, unit_id, value in facts.get(concept, []):
+        context = contexts.get(context_id)
+        if not isinstance(value, float) or context is None or not _in_period(context, period_end, instant):
+            continue
+        if money and not units.get(unit_id, '').upper().endswith(':USD'):
+            continue
+        values.setdefault(context['dims'], value)
+    return values
+
+def segment_name(member):
+    """
+    Turn an XBRL member into a readable segment name.
+
+    Args:
+        - member (str): The member, e.g. "nvda:ComputeAndNetworkingMember".
+
+    Returns:
+        - str: The segment name, e.g. "Compute And Networking".
+    """
+    name = member.split(':')[-1]
+    name = re.sub(r'(Segment)?Member$', '', name) or name
+    return re.sub(r'(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])', ' ', name)
+
+def format_billions(value):
+    """Format an amount in dollars the way the analyses write it, e.g. "-$9.170 billion"."""
+    return f"{'-' if value < 0 else ''}${abs(value) / 1e9:.3f} billion"
+
+def format_percent(value):
+    """Format a percentage the way the analyses write it, e.g. "9.9%"."""
+    return f"{value:.1f}%"
+
+def _segmented(facts, contexts, units, concepts, period_end):
+    """The segments of the first concept with a total, or {"Total": total} if no segments add up to it."""
+    all_values = [_values(facts, contexts, units, concept, period_end) for concept in concepts]
+    totals = [values[()] for values in all_values if () in values]
+    if not totals:
+        return None
+    total = totals[0]
+    for axis in SEGMENT_AXES:
+        for values in all_values:
+            segments = {segment_name(dims[0][1]): value for dims, value in values.items()
+                        if len(dims) == 1 and dims[0][0] == axis}
+            if len(segments) > 1 and abs(sum(segments.values()) - total) <= SEGMENT_SUM_TOLERANCE * abs(total):
+                return {name: format_billions(value) for name, value in segments.items()}
+    return {"Total": format_billions(total)}
+
+def _total(facts, contexts, units, concepts, period_end, instant=False, money=True):
+    for concept in concepts:
+        values = _values(facts, contexts, units, concept, period_end, instant, money)
+        if () in values:
+            return values[()]
+    return None
+
+def extract_analysis(filing_html_path):
+    """
+    Extract the main fields of the analysis from the inline XBRL facts of a filing.
+
+    Args:
+        - filing_html_path (str): The path to the filing document.
+
+    Returns:
+        - dict: The fields that could be resolved, in the format of analysis.json, e.g.
+          {"Revenue": {"Graphics": "$11.718 billion", ...}, "Effective Tax Rate": "9.9%"}.
+          Empty for filings without inline XBRL.
+    """
+    facts, contexts, units = read_facts(filing_html_path)
+    period_end = fiscal_period_end(facts, contexts)
+    if period_end is None:
+        return {}
+
+    analysis = {}
+    revenue = _segmented(facts, contexts, units, REVENUE_CONCEPTS, period_end)
+    if revenue is not None:
+        analysis["Revenue"] = revenue
+    net_income = _segmented(facts, contexts, units, NET_INCOME_CONCEPTS, period_end)
+    if net_income is not None:
+        analysis["Net Income"] = net_income
+
+    tax_rate = _total(facts, contexts, units, TAX_RATE_CONCEPTS, period_end, money=False)
+    if tax_rate is not None:
+        analysis["Effective Tax Rate"] = format_percent(tax_rate * 100)
+    deferred_tax_assets = _total(facts, contexts, units, DEFERRED_TAX_ASSETS_CONCEPTS, period_end, instant=True)
+    if deferred_tax_assets is not None:
+        analysis["Deferred Tax Assets"] = format_billions(deferred_tax_assets)
+    deferred_tax_liabilities = _total(facts, contexts, units, DEFERRED_TAX_LIABILITIES_CONCEPTS, period_end, instant=True)
+    if deferred_tax_liabilities is not None:
+        analysis["Deferred Tax Liabilities"] = format_billions(deferred_tax_liabilities)
+
+    foreign = _total(facts, contexts, units, [FOREIGN_INCOME_CONCEPT], period_end)
+    pretax = _total(facts, contexts, units, [PRETAX_INCOME_CONCEPT], period_end)
+    if pretax is None:
+        domestic = _total(facts, contexts, units, [DOMESTIC_INCOME_CONCEPT], period_end)
+        pretax = None if foreign is None or domestic is None else foreign + domestic
+    if foreign is not None and pretax:
+        analysis["Foreign Income Percentage"] = format_percent(foreign / pretax * 100)
+    return analysis
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the analysis fields tagged as inline XBRL in 10-K filings")
+    parser.add_argument('filings', nargs='+', help="The paths to the filing documents")
+    args = parser.parse_args()
+
+    for path in args.filings:
+        print(path)
+        print(json.dumps(extract_analysis(path), indent=4))
+
+if __name__ == '__main__':
+    main()